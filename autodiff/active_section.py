@@ -1,29 +1,111 @@
+import threading
+from contextvars import ContextVar
+from functools import wraps
 from itertools import count
-from singleton_decorator import singleton
-from autodiff.graph import GraphAdjacencyList
+import numpy as np
+from autodiff.graph import GraphCSR, FlattenedGraph
+from autodiff.graph_cache import GraphCache, GraphStructure, value_key
+from autodiff.graph_passes import optimize_graph
+from autodiff.shapes import infer_shape, check_scalar_graph
+from autodiff.backend.execution_plan import jacobian_costs
+from autodiff.backend.forward_accumulation_backend import ForwardAccumulationBackend
+from autodiff.backend.reverse_accumulation_backend import ReverseAccumulationBackend
+
+
+# Stack of the sections entered in the current context (thread, or asyncio task), innermost last. Held as a tuple s.t.
+# contexts never share a mutable stack.
+_section_stack = ContextVar('section_stack', default=())
+
+# The (section, token) pairs of the with blocks entered in the current context, innermost last. The token of an entry
+# restores the stack as it was before that entry.
+_section_tokens = ContextVar('section_tokens', default=())
+
+# Section used by the nodes built outside of any with block.
+_default_section = None
+_default_section_lock = threading.Lock()
 
 
 def active_section():
-    return ActiveSection()
+    """
+    :return:    The innermost section entered in the current context, or the process-wide default section if there is
+                none.
+    """
+
+    stack = _section_stack.get()
+    if len(stack) > 0:
+        return stack[-1]
+
+    global _default_section
+    with _default_section_lock:
+        if _default_section is None:
+            _default_section = ActiveSection()
+        return _default_section
 
 
 def init_active_section():
-    a = ActiveSection()
+    a = active_section()
     a.reset_section()
     return a
 
 
-@singleton
+def _synchronized(method):
+    # Runs the method under the lock of the section.
+    @wraps(method)
+    def synchronized_method(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return synchronized_method
+
+
 class ActiveSection:
+    """
+    Holds the graph of a model, along with its backend, optimizer and cached graphs. Nodes register into the section
+    active in the current context, i.e. the innermost section entered (with statement) by the current thread or
+    asyncio task. Every section is independent, s.t. several models can be built and trained concurrently, each in its
+    own section.
+
+    The methods of a section run under a per-section lock, s.t. a section can also be shared by several threads.
+    """
 
     def __init__(self):
+        self._lock = threading.RLock()
         self._node_id_counter = count(0, 1)
 
-        # Node info
-        self.graph = GraphAdjacencyList()
-        self.graph_ops_map = {}
+        # Node info. The graph holds the node ids and edges, and the op name and per-sample shape of every node are kept
+        # by dense index (insertion rank) alongside it. The backend-ready form is only built when it is needed (see
+        # flatten_graph).
+        self.graph = GraphCSR()
+        self.node_ops = []
+        self.node_shapes = []
         self.op_id_set = set()
         self.variables = []
+        self.constants = {}
+
+        # Shapes are interned, s.t. the nodes of a shape share a single tuple.
+        self._shapes = {}
+
+        # Structural hash of the graph, updated on every node registration.
+        self.graph_hash = 0
+
+        # Version of the graph structure, bumped on every node registration and reset. Never reused, s.t. a version
+        # identifies a structure for the lifetime of the section.
+        self.graph_version = 0
+
+        # The flattened graph handed out for the current version, along with its (version, graph passes) key.
+        self._flattened_graph = None
+        self._flattened_key = None
+
+        # Flattened graphs and compiled backend state, keyed by graph hash. Survives section resets.
+        self.graph_cache = GraphCache()
+
+        # Whether to run the optimization passes (constant folding, CSE) over the graph handed to the backend.
+        self.graph_passes = True
+        self._initialized_capabilities = None
+
+        # The backend and graph last checked for tensor support, by identity.
+        self._checked_backend = None
+        self._checked_graph = None
 
         # Optimizer
         self.optimizer = None
@@ -34,33 +116,80 @@ class ActiveSection:
         # Loss node
         self.loss_id = None
 
+        # Backends used by jacobian, per accumulation mode. Created on the first call.
+        self.jacobian_backends = {}
+
     def __enter__(self):
-        self.reset_section()
+        token = _section_stack.set(_section_stack.get() + (self,))
+        _section_tokens.set(_section_tokens.get() + ((self, token),))
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        return True
+        entries = _section_tokens.get()
+        if (len(entries) == 0) or (entries[-1][0] is not self):
+            raise ValueError('The section is not the innermost section entered in the current context.')
+
+        _section_tokens.set(entries[:-1])
+        _section_stack.reset(entries[-1][1])
+        return False
 
+    @_synchronized
     def reset_section(self):
         self._node_id_counter = count(0, 1)
-        self.graph = GraphAdjacencyList()
-        self.graph_ops_map = {}
+        self.graph = GraphCSR()
+        self.node_ops = []
+        self.node_shapes = []
         self.op_id_set = set()
         self.variables = []
         self.constants = {}
+        self._shapes = {}
+        self.loss_id = None
+        self.graph_hash = 0
+        self.graph_version += 1
 
+    @_synchronized
     def next_id(self):
         return next(self._node_id_counter)
 
+    @_synchronized
     def register_node(self, graph_node):
         graph_node_id = graph_node.identifier
         op_id = graph_node.op_id
+        input_ids = tuple(incoming_node.identifier for incoming_node in graph_node.incoming)
 
+        # The shape is inferred first, s.t. a node with incompatible inputs is rejected before anything is registered.
+        # Node ids are only unique within a section, so the inputs are checked by section too.
+        input_indices = []
+        for incoming_node in graph_node.incoming:
+            input_index = self.graph.index_of(incoming_node.identifier)
+            if (getattr(incoming_node, 'section', None) is not self) or (input_index < 0):
+                raise ValueError('Node {} is not part of this section.'.format(incoming_node.identifier))
+            input_indices.append(input_index)
+
+        if op_id in ('constant', 'variable'):
+            shape = np.shape(graph_node.extra_info)
+        elif op_id == 'feeder':
+            shape = tuple(graph_node.extra_info or ())
+        else:
+            shape = infer_shape(op_id, [self.node_shapes[input_index] for input_index in input_indices])
+        shape = self._shapes.setdefault(shape, shape)
+
+        graph_node.section = self
         self.graph.add_node(graph_node_id)
-        self.graph_ops_map[graph_node_id] = op_id
+        self.node_ops.append(op_id)
+        self.node_shapes.append(shape)
         self.op_id_set.add(op_id)
-        for incoming_node in graph_node.incoming:
-            self.graph.add_edge(incoming_node.identifier, graph_node_id, 1)
+        for input_id in input_ids:
+            self.graph.add_edge(input_id, graph_node_id, 1)
+        self.graph_version += 1
+
+        # Chain the node into the structural hash. Constant values are hashed too, since they can be folded, and so
+        # are the shapes of the inputs, since they determine the shapes of the whole graph.
+        if op_id == 'constant':
+            leaf_key = value_key(graph_node.extra_info)
+        else:
+            leaf_key = shape if len(input_ids) == 0 else None
+        self.graph_hash = hash((self.graph_hash, graph_node_id, op_id, input_ids, leaf_key))
 
         # When dealing with a probe/variable, register its reference so that it can be updated after optimization.
         if op_id == 'variable':
@@ -73,6 +202,7 @@ class ActiveSection:
         if op_id == 'loss':
             self.register_loss(graph_node)
 
+    @_synchronized
     def register_backend(self, backend):
         self.backend = backend
 
@@ -80,69 +210,218 @@ class ActiveSection:
             if self.optimizer.backend is None:
                 self.optimizer.backend = self.backend
 
+    @_synchronized
     def register_optimizer(self, optimizer):
         self.optimizer = optimizer
 
         if self.backend is not None:
             self.optimizer.backend = self.backend
 
+    @_synchronized
     def register_loss(self, loss_node):
         if self.loss_id is None:
             self.loss_id = loss_node.identifier
         else:
             raise ValueError('Cannot define more than one loss function per model.')
 
+    @_synchronized
     def flatten_graph(self):
-        graph_dict = {}
-        for node_id in self.graph_ops_map.keys():
-            op = self.graph_ops_map[node_id]
-            input_ids = [input_id for input_id, _ in self.graph.incoming(node_id)]
-            output_ids = [output_id for output_id, _ in self.graph.outgoing(node_id)]
-            graph_dict[node_id] = {
-                'op': op,
-                'input_ids': input_ids,
-                'output_ids': output_ids
+        """
+        Builds the backend-compatible form of the graph from the graph arrays (shapes included). The result is not
+        affected by later registrations.
+
+        :return:    A FlattenedGraph mapping node ids to <op name, input ids, output ids, shape>.
+        """
+
+        node_ids = self.graph.node_ids().tolist()
+        in_indptr, in_indices, _ = self.graph.incoming_arrays()
+        out_indptr, out_indices, _ = self.graph.outgoing_arrays()
+        in_indptr, in_indices = in_indptr.tolist(), in_indices.tolist()
+        out_indptr, out_indices = out_indptr.tolist(), out_indices.tolist()
+
+        graph_dict = {
+            node_id: {
+                'op': self.node_ops[i],
+                'input_ids': in_indices[in_indptr[i]:in_indptr[i + 1]],
+                'output_ids': out_indices[out_indptr[i]:out_indptr[i + 1]],
+                'shape': self.node_shapes[i]
             }
-        return graph_dict
+            for i, node_id in enumerate(node_ids)
+        }
+
+        return FlattenedGraph(graph_dict, graph_hash=self.graph_hash, ops=set(self.op_id_set),
+                              constants=dict(self.constants))
+
+    @_synchronized
+    def graph_structure(self):
+        """
+        :return:    A GraphStructure snapshot of the graph, built from the graph arrays.
+        """
+
+        in_indptr, in_indices, _ = self.graph.incoming_arrays()
+        return GraphStructure(self.graph.node_ids().copy(), in_indptr, in_indices, tuple(self.node_ops),
+                              tuple(self.node_shapes), dict(self.constants))
+
+    @property
+    def graph_ops_map(self):
+        """
+        :return:    A dict mapping node ids to their op name.
+        """
+
+        with self._lock:
+            return dict(zip(self.graph.node_ids().tolist(), self.node_ops))
+
+    @_synchronized
+    def cached_graph(self):
+        """
+        Returns the flattened graph from the graph cache, flattening (and optimizing) it only when the structure is
+        not cached. The backend state compiled for a cached graph (e.g. execution plans) is kept on it, s.t. it is
+        reused too.
+
+        As long as the graph version does not change, the graph handed out last is returned as is.
+
+        :return:    A FlattenedGraph mapping node ids to <op name, input ids, output ids, shape>.
+        """
+
+        if self._flattened_key == (self.graph_version, self.graph_passes):
+            return self._flattened_graph
+
+        # A hit is checked against the structure stored with the entry, s.t. a hash collision is a miss.
+        key = (self.graph_hash, len(self.node_ops), self.graph_passes)
+        structure = self.graph_structure()
+
+        flattened_graph = self.graph_cache.get(key, structure)
+        if flattened_graph is None:
+            flattened_graph = self.flatten_graph()
+            if self.graph_passes:
+                flattened_graph = optimize_graph(flattened_graph, self.constants)
+            self.graph_cache.put(key, flattened_graph, structure)
+
+        self._flattened_graph = flattened_graph
+        self._flattened_key = (self.graph_version, self.graph_passes)
 
+        return flattened_graph
+
+    @_synchronized
+    def prepare_backend(self):
+        """
+        Fetches the flattened graph and initializes the backend capabilities for it. The backend is only
+        re-initialized when it changes or the graph needs a different set of ops.
+
+        A graph holding tensor nodes is rejected up front (ValueError) for the backends that only handle scalars, i.e.
+        the ones whose supports_tensors attribute is not set.
+
+        :return:    The flattened graph.
+        """
+
+        flattened_graph = self.cached_graph()
+
+        if (self._checked_backend is not self.backend) or (self._checked_graph is not flattened_graph):
+            if not getattr(self.backend, 'supports_tensors', False):
+                check_scalar_graph(flattened_graph, getattr(self.backend, 'name', type(self.backend).__name__))
+            self._checked_backend = self.backend
+            self._checked_graph = flattened_graph
+
+        needed_ops = frozenset(flattened_graph.ops.difference({'loss'}))
+        if self._initialized_capabilities != (self.backend, needed_ops):
+            self.backend.init_capabilities(set(needed_ops))
+            self._initialized_capabilities = (self.backend, needed_ops)
+
+        return flattened_graph
+
+    @_synchronized
+    def pass_report(self):
+        """
+        Reports the node-count reduction achieved by the optimization passes on the current graph.
+
+        :return:    A copy of the dict with the node counts before/after the passes and the number of folded,
+                    deduplicated and merged nodes. None if the passes are disabled.
+        """
+
+        report = self.cached_graph().report
+        return None if report is None else dict(report)
+
+    @_synchronized
     def optimize_model(self, feed_dict):
         if (self.optimizer is None) or (self.backend is None) or (len(self.variables) == 0) or (self.loss_id is None):
             raise AttributeError('Incomplete definition of model. Missing loss/optimizer/backend/variables.')
 
-        # Translate graph into backend-compatible-graph.
-        # TODO: Use a graph hash to enable caching in the backend.
-        flattened_graph = self.flatten_graph()
-
-        # Initialize backend
-        needed_ops = set(self.graph_ops_map.values()).difference({'loss'})
-        self.backend.init_capabilities(needed_ops)
+        # Translate graph into backend-compatible-graph and initialize backend.
+        flattened_graph = self.prepare_backend()
 
         # Call optimizer using selected backend
         self.optimizer.optimize(graph=flattened_graph,
                                 variable_ids=[v.identifier for v in self.variables],
-                                loss_id=self.loss_id,
+                                loss_id=flattened_graph.resolve(self.loss_id),
                                 feed_dict={k.identifier: v for k, v in feed_dict.items()},
-                                variable_init_feed_dict={v.identifier: 0.0 for v in self.variables},
-                                constant_feed_dict=self.constants)
+                                variable_init_feed_dict={v.identifier: _zeros_like(v.extra_info)
+                                                         for v in self.variables},
+                                constant_feed_dict=flattened_graph.constants)
 
         # Update variable values.
         var_values = self.optimizer.get_variable_values()
         for v in self.variables:
             v.extra_info = var_values[v.identifier]
 
+    @_synchronized
     def eval(self, node, feed_dict):
         if (self.optimizer is None) or (self.backend is None) or (len(self.variables) == 0) or (self.loss_id is None):
             raise AttributeError('Incomplete definition of model. Missing loss/optimizer/backend/variables.')
 
-        flattened_graph = self.flatten_graph()
-
-        # Initialize backend
-        needed_ops = set(self.graph_ops_map.values()).difference({'loss'})
-        self.backend.init_capabilities(needed_ops)
+        flattened_graph = self.prepare_backend()
 
         # Call optimizer using selected backend
         return self.backend.values(graph=flattened_graph,
                                    feed_dict={k.identifier: v for k, v in feed_dict.items()},
-                                   target_node_id=node.identifier,
+                                   target_node_id=flattened_graph.resolve(node.identifier),
                                    variable_feed_dict={v.identifier: v.extra_info for v in self.variables},
-                                   constant_feed_dict=self.constants)
+                                   constant_feed_dict=flattened_graph.constants)
+
+    @_synchronized
+    def jacobian(self, outputs, inputs, feed_dict=None, mode=None):
+        """
+        Computes the Jacobian of several output nodes w.r.t. several input nodes, for every sample of the feed. The
+        accumulation mode is picked by a cost model over the flattened graph (see jacobian_costs): forward mode, with
+        one tangent lane per input, when there are fewer inputs than outputs, reverse mode, with one adjoint pass per
+        output, otherwise. No loss, optimizer nor backend needs to be registered.
+
+        :param outputs:     The nodes being differentiated.
+        :param inputs:      The variable/feeder nodes to differentiate with respect to.
+        :param feed_dict:   Dict mapping feeder nodes to a list of input values.
+        :param mode:        Forces the accumulation mode, <forward> or <reverse>.
+        :return:            An array of shape (outputs, inputs, batch length), holding d output / d input per sample.
+        """
+
+        for node in inputs:
+            if node.op_id not in ('variable', 'feeder'):
+                raise ValueError('Can only differentiate w.r.t. variables and feeders. Got {}.'.format(node.op_id))
+
+        flattened_graph = self.cached_graph()
+        output_ids = [flattened_graph.resolve(node.identifier) for node in outputs]
+        input_ids = [node.identifier for node in inputs]
+
+        if mode is None:
+            costs = jacobian_costs(flattened_graph, output_ids, input_ids)
+            mode = 'forward' if costs['forward'] < costs['reverse'] else 'reverse'
+        if mode not in ('forward', 'reverse'):
+            raise ValueError('Unknown accumulation mode: {}.'.format(mode))
+
+        if mode not in self.jacobian_backends:
+            self.jacobian_backends[mode] = (ForwardAccumulationBackend(vectorized=True) if mode == 'forward'
+                                            else ReverseAccumulationBackend())
+        backend = self.jacobian_backends[mode]
+        backend.init_capabilities(set(flattened_graph.ops.difference({'loss'})))
+
+        return backend.jacobian(graph=flattened_graph,
+                                output_ids=output_ids,
+                                input_ids=input_ids,
+                                feed_dict={} if feed_dict is None else {k.identifier: v for k, v in feed_dict.items()},
+                                variable_feed_dict={v.identifier: v.extra_info for v in self.variables},
+                                constant_feed_dict=flattened_graph.constants)
+
+
+def _zeros_like(value):
+    # Initial value of a variable: 0.0 for scalars, zeros of the same shape for arrays.
+    if np.ndim(value) == 0:
+        return 0.0
+    return np.zeros(np.shape(value))
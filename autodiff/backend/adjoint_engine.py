@@ -0,0 +1,406 @@
+from functools import partial
+
+import numpy as np
+from autodiff.backend import kernels
+
+
+class AdjointEngine:
+    """
+    Op table used by reverse accumulation. Every op has a forward function, mapping input values to the output
+    value, and an adjoint function, mapping (output adjoint, output value, *input values) to a tuple with the adjoint
+    contribution of every input.
+
+    Values carry a trailing batch axis (of the batch length, or 1 for the values shared by all samples), behind the
+    per-sample shape of the node. Element-wise adjoints may come out broadcast, the backend sums them back to the shape
+    of their input.
+
+    For forward-over-reverse (Hessian-vector products), every op also has a tangent function, mapping (output, input
+    values, input tangents) to the tangent of the output, and an adjoint tangent function, mapping (output adjoint,
+    output adjoint tangent, output, output tangent, input values, input tangents) to a tuple with the tangent of the
+    adjoint contribution of every input. A None tangent stands for a null one (i.e. a value that does not depend on
+    the seeded variables). The contributions to inputs with a null tangent lead to no variable and may be left out.
+    """
+
+    def __init__(self, ops_set=None):
+        self.ops = {
+            'constant': (None, None),
+            'variable': (None, None),
+            'feeder': (None, None),
+            'loss': (_identity, _adjoint_identity),
+            'add': (_add, _adjoint_add),
+            'sub': (_sub, _adjoint_sub),
+            'mul': (_mul, _adjoint_mul),
+            'sqrt': (_sqrt, _adjoint_sqrt),
+            'pow': (_pow, _adjoint_pow),
+            'div': (_div, _adjoint_div),
+            'logistic': (kernels.logistic, _adjoint_logistic),
+            'abs': (np.abs, _adjoint_abs),
+            'sin': (np.sin, _adjoint_sin),
+            'cos': (np.cos, _adjoint_cos),
+            'tan': (np.tan, _adjoint_tan),
+            'tanh': (np.tanh, _adjoint_tanh),
+            'arctan': (np.arctan, _adjoint_arctan),
+            'exp': (np.exp, _adjoint_exp),
+            'log': (np.log10, _adjoint_log),
+            'ln': (np.log, _adjoint_ln),
+            'erf': (kernels.erf, _adjoint_erf),
+            'gudermann': (kernels.gudermann, _adjoint_gudermann),
+            'softplus': (kernels.softplus, _adjoint_softplus),
+            'rectifier': (kernels.rectifier, _adjoint_rectifier),
+            'squared_error': (kernels.squared_error, _adjoint_squared_error),
+            'logistic_log_loss': (kernels.logistic_log_loss, _adjoint_logistic_log_loss),
+            'matmul': (_matmul, _adjoint_matmul),
+            'sum': (_sum, _adjoint_sum),
+            'mean': (_mean, _adjoint_mean)
+        }
+
+        # The rules are module-level functions (or partials of them), s.t. the engine stays picklable.
+        self.tangent_ops = {op: (partial(_tangent_unary, op), partial(_adjoint_tangent_unary, op))
+                            for op in _UNARY_DERIVATIVES.keys()}
+        self.tangent_ops.update({
+            'add': (_tangent_add, _adjoint_tangent_add),
+            'sub': (_tangent_sub, _adjoint_tangent_sub),
+            'mul': (_tangent_mul, _adjoint_tangent_mul),
+            'div': (_tangent_div, _adjoint_tangent_div),
+            'pow': (_tangent_pow, _adjoint_tangent_pow),
+            'squared_error': (_tangent_squared_error, _adjoint_tangent_squared_error),
+            'logistic_log_loss': (_tangent_logistic_log_loss, _adjoint_tangent_logistic_log_loss),
+            'matmul': (_tangent_matmul, _adjoint_tangent_matmul),
+            'sum': (partial(_tangent_linear, _sum), partial(_adjoint_tangent_linear, _adjoint_sum)),
+            'mean': (partial(_tangent_linear, _mean), partial(_adjoint_tangent_linear, _adjoint_mean))
+        })
+
+        if ops_set is not None:
+            set_diff = ops_set.difference(self.ops.keys())
+            if len(set_diff) > 0:
+                raise ValueError('Operations not implemented in adjoint engine: {}'.format(set_diff))
+
+    def forward(self, op, *args):
+        return self.ops[op][0](*args)
+
+    def adjoint(self, op, adjoint, output, *args):
+        return self.ops[op][1](adjoint, output, *args)
+
+    def tangent(self, op, output, args, arg_tangents):
+        return self.tangent_ops[op][0](output, args, arg_tangents)
+
+    def adjoint_tangent(self, op, adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+        return self.tangent_ops[op][1](adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents)
+
+
+def _identity(a):
+    return a
+
+
+def _adjoint_identity(adjoint, output, a):
+    return adjoint,
+
+
+def _add(a, b):
+    return a + b
+
+
+def _adjoint_add(adjoint, output, a, b):
+    return adjoint, adjoint
+
+
+def _sub(a, b):
+    return a - b
+
+
+def _adjoint_sub(adjoint, output, a, b):
+    return adjoint, -adjoint
+
+
+def _mul(a, b):
+    return a * b
+
+
+def _adjoint_mul(adjoint, output, a, b):
+    return adjoint * b, adjoint * a
+
+
+def _div(a, b):
+    return a / b
+
+
+def _adjoint_div(adjoint, output, a, b):
+    return adjoint / b, -adjoint * output / b
+
+
+def _sqrt(a):
+    return np.sqrt(a)
+
+
+def _adjoint_sqrt(adjoint, output, a):
+    return adjoint / (2 * output),
+
+
+def _pow(a, power):
+    return a ** power
+
+
+def _adjoint_pow(adjoint, output, a, power):
+    return adjoint * power * (a ** (power - 1)), adjoint * output * np.log(a)
+
+
+def _adjoint_logistic(adjoint, output, a):
+    return adjoint * output * (1 - output),
+
+
+def _adjoint_abs(adjoint, output, a):
+    return adjoint * np.sign(a),
+
+
+def _adjoint_sin(adjoint, output, a):
+    return adjoint * np.cos(a),
+
+
+def _adjoint_cos(adjoint, output, a):
+    return -adjoint * np.sin(a),
+
+
+def _adjoint_tan(adjoint, output, a):
+    return adjoint * (1 + output * output),
+
+
+def _adjoint_tanh(adjoint, output, a):
+    return adjoint * (1 - output * output),
+
+
+def _adjoint_arctan(adjoint, output, a):
+    return adjoint / (1 + a * a),
+
+
+def _adjoint_exp(adjoint, output, a):
+    return adjoint * output,
+
+
+def _adjoint_log(adjoint, output, a):
+    return adjoint / (a * np.log(10)),
+
+
+def _adjoint_ln(adjoint, output, a):
+    return adjoint / a,
+
+
+def _adjoint_erf(adjoint, output, a):
+    return adjoint * kernels.erf_derivative(a),
+
+
+def _adjoint_gudermann(adjoint, output, a):
+    return adjoint * np.cos(output),
+
+
+def _adjoint_softplus(adjoint, output, a):
+    return adjoint * kernels.logistic(a),
+
+
+def _adjoint_rectifier(adjoint, output, a):
+    return adjoint * kernels.step(a),
+
+
+def _adjoint_squared_error(adjoint, output, a, b):
+    scaled = 2 * adjoint * (a - b)
+    return scaled, -scaled
+
+
+def _adjoint_logistic_log_loss(adjoint, output, logits, labels):
+    return adjoint * (kernels.logistic(logits) - labels), -adjoint * logits
+
+
+def _matmul_subscripts(a, b):
+    # einsum subscripts of a per-sample vector/matrix product, the batch axis being the trailing ellipsis.
+    a_sub = 'ij' if np.ndim(a) == 3 else 'j'
+    b_sub = 'jk' if np.ndim(b) == 3 else 'j'
+    out_sub = a_sub[:-1] + b_sub[1:]
+    return a_sub + '...', b_sub + '...', out_sub + '...'
+
+
+def _matmul(a, b):
+    a_sub, b_sub, out_sub = _matmul_subscripts(a, b)
+    return np.einsum('{},{}->{}'.format(a_sub, b_sub, out_sub), a, b)
+
+
+def _adjoint_matmul(adjoint, output, a, b):
+    a_sub, b_sub, out_sub = _matmul_subscripts(a, b)
+    return (np.einsum('{},{}->{}'.format(out_sub, b_sub, a_sub), adjoint, b),
+            np.einsum('{},{}->{}'.format(out_sub, a_sub, b_sub), adjoint, a))
+
+
+def _sum(a):
+    return np.sum(a, axis=tuple(range(np.ndim(a) - 1)))
+
+
+def _adjoint_sum(adjoint, output, a):
+    return np.broadcast_to(adjoint, np.shape(a)[:-1] + np.shape(adjoint)[-1:]),
+
+
+def _mean(a):
+    return np.mean(a, axis=tuple(range(np.ndim(a) - 1)))
+
+
+def _adjoint_mean(adjoint, output, a):
+    size = int(np.prod(np.shape(a)[:-1]))
+    return np.broadcast_to(adjoint / size, np.shape(a)[:-1] + np.shape(adjoint)[-1:]),
+
+
+# Tangent rules (forward-over-reverse). The terms of a tangent are dropped when they involve a null (None) tangent.
+
+def _terms(*terms):
+    # Sums the non-null terms, None if there is none.
+    terms = [term for term in terms if term is not None]
+    if len(terms) == 0:
+        return None
+    return sum(terms[1:], terms[0])
+
+
+def _scaled(tangent, factor):
+    return None if tangent is None else tangent * factor
+
+
+# First and second derivatives of the element-wise unary ops, as functions of (input, output). A None second
+# derivative stands for a null one.
+_UNARY_DERIVATIVES = {
+    'loss': (lambda a, output: 1.0, None),
+    'sqrt': (lambda a, output: 1 / (2 * output), lambda a, output: -1 / (4 * output ** 3)),
+    'logistic': (lambda a, output: output * (1 - output), lambda a, output: output * (1 - output) * (1 - 2 * output)),
+    'abs': (lambda a, output: np.sign(a), None),
+    'sin': (lambda a, output: np.cos(a), lambda a, output: -output),
+    'cos': (lambda a, output: -np.sin(a), lambda a, output: -output),
+    'tan': (lambda a, output: 1 + output * output, lambda a, output: 2 * output * (1 + output * output)),
+    'tanh': (lambda a, output: 1 - output * output, lambda a, output: -2 * output * (1 - output * output)),
+    'arctan': (lambda a, output: 1 / (1 + a * a), lambda a, output: -2 * a / (1 + a * a) ** 2),
+    'exp': (lambda a, output: output, lambda a, output: output),
+    'log': (lambda a, output: 1 / (a * np.log(10)), lambda a, output: -1 / (a * a * np.log(10))),
+    'ln': (lambda a, output: 1 / a, lambda a, output: -1 / (a * a)),
+    'erf': (lambda a, output: kernels.erf_derivative(a), lambda a, output: -2 * a * kernels.erf_derivative(a)),
+    'gudermann': (lambda a, output: np.cos(output), lambda a, output: -np.sin(output) * np.cos(output)),
+    'softplus': (lambda a, output: kernels.logistic(a),
+                 lambda a, output: kernels.logistic(a) * (1 - kernels.logistic(a))),
+    'rectifier': (lambda a, output: kernels.step(a), None)
+}
+
+
+def _tangent_unary(op, output, args, arg_tangents):
+    first, _ = _UNARY_DERIVATIVES[op]
+    return _scaled(arg_tangents[0], first(args[0], output))
+
+
+def _adjoint_tangent_unary(op, adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    # The contribution adjoint * f'(a) has the tangent adjoint' * f'(a) + adjoint * f''(a) * a'.
+    first, second = _UNARY_DERIVATIVES[op]
+    (a,), (a_tangent,) = args, arg_tangents
+    curvature = None if second is None else _scaled(a_tangent, adjoint * second(a, output))
+    return _terms(_scaled(adjoint_tangent, first(a, output)), curvature),
+
+
+def _tangent_linear(forward, output, args, arg_tangents):
+    # Ops linear in their single input: the rules apply to the tangents as they are.
+    return None if arg_tangents[0] is None else forward(arg_tangents[0])
+
+
+def _adjoint_tangent_linear(adjoint_function, adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    return (None if adjoint_tangent is None else adjoint_function(adjoint_tangent, None, args[0])[0]),
+
+
+def _tangent_add(output, args, arg_tangents):
+    return _terms(*arg_tangents)
+
+
+def _adjoint_tangent_add(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    return adjoint_tangent, adjoint_tangent
+
+
+def _tangent_sub(output, args, arg_tangents):
+    return _terms(arg_tangents[0], _scaled(arg_tangents[1], -1))
+
+
+def _adjoint_tangent_sub(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    return adjoint_tangent, _scaled(adjoint_tangent, -1)
+
+
+def _tangent_mul(output, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    return _terms(_scaled(a_tangent, b), _scaled(b_tangent, a))
+
+
+def _adjoint_tangent_mul(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    return (_terms(_scaled(adjoint_tangent, b), _scaled(b_tangent, adjoint)),
+            _terms(_scaled(adjoint_tangent, a), _scaled(a_tangent, adjoint)))
+
+
+def _tangent_div(output, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    return _terms(_scaled(a_tangent, 1 / b), _scaled(b_tangent, -output / b))
+
+
+def _adjoint_tangent_div(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    return (_terms(_scaled(adjoint_tangent, 1 / b), _scaled(b_tangent, -adjoint / (b * b))),
+            _terms(_scaled(adjoint_tangent, -output / b), _scaled(output_tangent, -adjoint / b),
+                   _scaled(b_tangent, adjoint * output / (b * b))))
+
+
+def _tangent_pow(output, args, arg_tangents):
+    (a, power), (a_tangent, power_tangent) = args, arg_tangents
+    return _terms(_scaled(a_tangent, power * (a ** (power - 1))),
+                  None if power_tangent is None else power_tangent * output * np.log(a))
+
+
+def _adjoint_tangent_pow(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    (a, power), (a_tangent, power_tangent) = args, arg_tangents
+
+    # The logarithm of the base is only taken when the power depends on the variables.
+    a_contribution = _terms(
+        _scaled(adjoint_tangent, power * (a ** (power - 1))),
+        _scaled(a_tangent, adjoint * power * (power - 1) * (a ** (power - 2))),
+        None if power_tangent is None else power_tangent * adjoint * (a ** (power - 1)) * (1 + power * np.log(a)))
+    power_contribution = None
+    if power_tangent is not None:
+        power_contribution = _terms(_scaled(adjoint_tangent, output * np.log(a)),
+                                    _scaled(output_tangent, adjoint * np.log(a)),
+                                    _scaled(a_tangent, adjoint * output / a))
+
+    return a_contribution, power_contribution
+
+
+def _tangent_squared_error(output, args, arg_tangents):
+    a, b = args
+    return _scaled(_tangent_sub(None, args, arg_tangents), 2 * (a - b))
+
+
+def _adjoint_tangent_squared_error(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    a, b = args
+    scaled = _terms(_scaled(adjoint_tangent, 2 * (a - b)),
+                    _scaled(_tangent_sub(None, args, arg_tangents), 2 * adjoint))
+    return scaled, _scaled(scaled, -1)
+
+
+def _tangent_logistic_log_loss(output, args, arg_tangents):
+    (logits, labels), (logits_tangent, labels_tangent) = args, arg_tangents
+    return _terms(_scaled(logits_tangent, kernels.logistic(logits) - labels), _scaled(labels_tangent, -logits))
+
+
+def _adjoint_tangent_logistic_log_loss(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    (logits, labels), (logits_tangent, labels_tangent) = args, arg_tangents
+    probabilities = kernels.logistic(logits)
+    return (_terms(_scaled(adjoint_tangent, probabilities - labels),
+                   _scaled(logits_tangent, adjoint * probabilities * (1 - probabilities)),
+                   _scaled(labels_tangent, -adjoint)),
+            _terms(_scaled(adjoint_tangent, -logits), _scaled(logits_tangent, -adjoint)))
+
+
+def _tangent_matmul(output, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    return _terms(None if a_tangent is None else _matmul(a_tangent, b),
+                  None if b_tangent is None else _matmul(a, b_tangent))
+
+
+def _adjoint_tangent_matmul(adjoint, adjoint_tangent, output, output_tangent, args, arg_tangents):
+    (a, b), (a_tangent, b_tangent) = args, arg_tangents
+    a_contribution, b_contribution = (None, None) if adjoint_tangent is None else _adjoint_matmul(adjoint_tangent,
+                                                                                                  None, a, b)
+    return (_terms(a_contribution, None if b_tangent is None else _adjoint_matmul(adjoint, None, a, b_tangent)[0]),
+            _terms(b_contribution, None if a_tangent is None else _adjoint_matmul(adjoint, None, a_tangent, b)[1]))
@@ -0,0 +1,252 @@
+import numpy as np
+from autodiff.backend import kernels
+from autodiff.backend.execution_plan import compile_plan
+from autodiff.backend.reducers import batch_length, make_reducer
+from autodiff.shapes import check_scalar_graph
+
+
+# Forward expression of every op, in terms of its input variables.
+_FORWARD_TEMPLATES = {
+    'loss': '{0}',
+    'add': '{0} + {1}',
+    'sub': '{0} - {1}',
+    'mul': '{0} * {1}',
+    'div': '{0} / {1}',
+    'sqrt': 'np.sqrt({0})',
+    'pow': '{0} ** {1}',
+    'logistic': 'kernels.logistic({0})',
+    'abs': 'np.abs({0})',
+    'sin': 'np.sin({0})',
+    'cos': 'np.cos({0})',
+    'tan': 'np.tan({0})',
+    'tanh': 'np.tanh({0})',
+    'arctan': 'np.arctan({0})',
+    'exp': 'np.exp({0})',
+    'log': 'np.log10({0})',
+    'ln': 'np.log({0})',
+    'erf': 'kernels.erf({0})',
+    'gudermann': 'kernels.gudermann({0})',
+    'softplus': 'kernels.softplus({0})',
+    'rectifier': 'kernels.rectifier({0})',
+    'squared_error': 'kernels.squared_error({0}, {1})',
+    'logistic_log_loss': 'kernels.logistic_log_loss({0}, {1})'
+}
+
+# Adjoint contribution of every op to each of its inputs, in terms of the output adjoint <g>, the output <out> and the
+# input variables.
+_ADJOINT_TEMPLATES = {
+    'loss': ('{g}',),
+    'add': ('{g}', '{g}'),
+    'sub': ('{g}', '-{g}'),
+    'mul': ('{g} * {1}', '{g} * {0}'),
+    'div': ('{g} / {1}', '-{g} * {out} / {1}'),
+    'sqrt': ('{g} / (2 * {out})',),
+    'pow': ('{g} * {1} * ({0} ** ({1} - 1))', '{g} * {out} * np.log({0})'),
+    'logistic': ('{g} * {out} * (1 - {out})',),
+    'abs': ('{g} * np.sign({0})',),
+    'sin': ('{g} * np.cos({0})',),
+    'cos': ('-{g} * np.sin({0})',),
+    'tan': ('{g} * (1 + {out} * {out})',),
+    'tanh': ('{g} * (1 - {out} * {out})',),
+    'arctan': ('{g} / (1 + {0} * {0})',),
+    'exp': ('{g} * {out}',),
+    'log': ('{g} / ({0} * np.log(10))',),
+    'ln': ('{g} / {0}',),
+    'erf': ('{g} * kernels.erf_derivative({0})',),
+    'gudermann': ('{g} * np.cos({out})',),
+    'softplus': ('{g} * kernels.logistic({0})',),
+    'rectifier': ('{g} * kernels.step({0})',),
+    'squared_error': ('2 * {g} * ({0} - {1})', '-2 * {g} * ({0} - {1})'),
+    'logistic_log_loss': ('{g} * (kernels.logistic({0}) - {1})', '-{g} * {0}')
+}
+
+_INPUT_OPS = {'constant': 'constants', 'variable': 'variables', 'feeder': 'feeds'}
+
+
+class CodegenBackend:
+    """
+        Local backend that compiles the computation graph into straight-line Python/NumPy functions.
+        For every graph and target node, it emits the source of two functions:
+
+        values(feeds, variables, constants)         - one local per node, evaluated in plan order.
+        gradients(feeds, variables, constants, n)   - the same forward code, followed by the unrolled adjoint
+                                                      (reverse accumulation) code for the target node. Returns the
+                                                      target value along with the variable adjoints.
+
+        The source is compiled once per graph (the functions are kept with the graph's compiled state, i.e. per graph
+        hash for cached graphs), s.t. sweeps run without any per-node dispatch. Feeders are evaluated as arrays
+        spanning the batch.
+    """
+
+    def __init__(self):
+        self.ops = None
+        self._compiled_graph = None
+        self._functions = None
+        self.name = 'codegen'
+        self.supports_tensors = False
+
+    def init_capabilities(self, ops_set):
+        supported_ops = set(_FORWARD_TEMPLATES.keys()).union(_INPUT_OPS.keys())
+        set_diff = ops_set.difference(supported_ops)
+        if len(set_diff) > 0:
+            raise ValueError('Operations not implemented in code generator: {}'.format(set_diff))
+
+        self.ops = ops_set
+
+    def values(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict):
+        """
+        Computes the values for the specified node using the generated value function.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the value.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :return:                    A list of values for all input values.
+        """
+
+        n = batch_length(feed_dict)
+        values_f, _ = self.compile(graph, target_node_id)
+        target_values = values_f(_batch_feeds(feed_dict, n), variable_feed_dict, constant_feed_dict)
+
+        return np.broadcast_to(target_values, (n,)).tolist()
+
+    def gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, reduce_strategy):
+        """
+        Computes the gradients for the variable nodes using the generated gradient function.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the derivative.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing a set of gradients.
+                                    Supports <avg>, <median>, <None> - returns list of gradients.
+        :return:                    A map that connects variable ids to
+                                    a gradient or list of gradients (if reduce strategy is set to None).
+        """
+
+        _, variable_gradient_map = self.value_and_gradients(graph, target_node_id, feed_dict, variable_feed_dict,
+                                                            constant_feed_dict, reduce_strategy)
+
+        return variable_gradient_map
+
+    def value_and_gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                            reduce_strategy):
+        """
+        Computes both the values of the target node and the gradients for the variable nodes, with a single call of the
+        generated gradient function.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the value and the derivative.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing a set of gradients.
+                                    Supports <avg>, <median>, <None> - returns list of gradients.
+        :return:                    A tuple (list of values for all input values, map of variable ids to gradients).
+        """
+
+        reducer = make_reducer(reduce_strategy)
+
+        n = batch_length(feed_dict)
+        _, gradients_f = self.compile(graph, target_node_id)
+        target_values, variable_adjoints = gradients_f(_batch_feeds(feed_dict, n), variable_feed_dict,
+                                                       constant_feed_dict, n)
+
+        variable_gradient_map = {variable_id: reducer(np.broadcast_to(variable_adjoints.get(variable_id, 0.0), (n,)))
+                                 for variable_id in variable_feed_dict.keys()}
+
+        return np.broadcast_to(target_values, (n,)).tolist(), variable_gradient_map
+
+    def compile(self, graph, target_node_id):
+        """
+        Generates and compiles the value and gradient functions of the graph for the target node.
+
+        :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:  The node evaluated/differentiated by the functions.
+        :return:                A tuple (values function, gradients function).
+        """
+
+        functions = getattr(graph, 'compiled', None)
+        if functions is None:
+            # Plain dict graphs: keep the functions of the last graph object.
+            if self._compiled_graph is not graph:
+                self._compiled_graph = graph
+                self._functions = {}
+            functions = self._functions
+
+        key = ('codegen', target_node_id)
+        if key not in functions:
+            check_scalar_graph(graph, self.name)
+            source = self.source(graph, target_node_id)
+            namespace = {'np': np, 'kernels': kernels}
+            exec(compile(source, '<codegen {}>'.format(getattr(graph, 'graph_hash', id(graph))), 'exec'), namespace)
+            functions[key] = (namespace['values'], namespace['gradients'])
+
+        return functions[key]
+
+    def source(self, graph, target_node_id):
+        """
+        Emits the Python source of the value and gradient functions of the graph for the target node.
+
+        :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:  The node evaluated/differentiated by the functions.
+        :return:                The source code, as a string.
+        """
+
+        # Only the nodes the target depends on are emitted.
+        plan = compile_plan(graph, target_node_id)
+        target_slot = plan.slots[target_node_id]
+
+        # Forward code: one local per node.
+        forward_lines = []
+        for slot, (op, node_id, input_slots) in enumerate(plan.instructions):
+            if op in _INPUT_OPS:
+                expression = '{}[{!r}]'.format(_INPUT_OPS[op], node_id)
+            else:
+                expression = _FORWARD_TEMPLATES[op].format(*[_value(input_slot) for input_slot in input_slots])
+            forward_lines.append('    {} = {}'.format(_value(slot), expression))
+
+        # Adjoint code: walk the plan backwards from the target, accumulating the contributions of each node.
+        adjoint_lines = ['    {} = np.ones(n)'.format(_adjoint(target_slot))]
+        has_adjoint = {target_slot}
+        for slot in range(target_slot, -1, -1):
+            op, _, input_slots = plan.instructions[slot]
+            if (slot not in has_adjoint) or (len(input_slots) == 0):
+                continue
+
+            names = [_value(input_slot) for input_slot in input_slots]
+            for input_slot, template in zip(input_slots, _ADJOINT_TEMPLATES[op]):
+                contribution = template.format(*names, g=_adjoint(slot), out=_value(slot))
+                if input_slot in has_adjoint:
+                    adjoint_lines.append('    {0} = {0} + {1}'.format(_adjoint(input_slot), contribution))
+                else:
+                    adjoint_lines.append('    {} = {}'.format(_adjoint(input_slot), contribution))
+                    has_adjoint.add(input_slot)
+
+        variable_adjoints = ['{!r}: {}'.format(node_id, _adjoint(slot))
+                             for slot, (op, node_id, _) in enumerate(plan.instructions)
+                             if (op == 'variable') and (slot in has_adjoint)]
+
+        lines = ['def values(feeds, variables, constants):']
+        lines += forward_lines
+        lines += ['    return {}'.format(_value(target_slot)), '', '']
+        lines += ['def gradients(feeds, variables, constants, n):']
+        lines += forward_lines
+        lines += adjoint_lines
+        lines += ['    return {}, {{{}}}'.format(_value(target_slot), ', '.join(variable_adjoints)), '']
+
+        return '\n'.join(lines)
+
+
+def _value(slot):
+    return 'v{}'.format(slot)
+
+
+def _adjoint(slot):
+    return 'g{}'.format(slot)
+
+
+def _batch_feeds(feeder_batch, n):
+    return {k: np.asarray(v[:n], dtype=float) for k, v in feeder_batch.items()}
@@ -1,3 +1,7 @@
+import numpy as np
+from autodiff.backend import kernels
+
+
 class DualNumberEngine:
     def __init__(self, ops_set=None):
         self.ops = {
@@ -11,7 +15,31 @@ class DualNumberEngine:
             'sqrt': _dual_sqrt,
             'pow': _dual_pow,
             'div': _dual_div,
-            'logistic': _dual_logistic
+            'logistic': _dual_logistic,
+            'abs': _dual_abs,
+            'sin': _dual_sin,
+            'cos': _dual_cos,
+            'tan': _dual_tan,
+            'tanh': _dual_tanh,
+            'arctan': _dual_arctan,
+            'exp': _dual_exp,
+            'log': _dual_log,
+            'ln': _dual_ln,
+            'erf': _dual_erf,
+            'gudermann': _dual_gudermann,
+            'softplus': _dual_softplus,
+            'rectifier': _dual_rectifier,
+            'squared_error': _dual_squared_error,
+            'logistic_log_loss': _dual_logistic_log_loss
+        }
+
+        # Variants of the ops writing their results into preallocated buffers.
+        self.into_ops = {
+            'loss': _dual_identity_into,
+            'add': _dual_add_into,
+            'sub': _dual_sub_into,
+            'mul': _dual_mul_into,
+            'div': _dual_div_into
         }
 
         if ops_set is not None:
@@ -22,7 +50,36 @@ class DualNumberEngine:
     def do(self, op, *args):
         return self.ops[op](*args)
 
+    def do_into(self, op, buffer, *args):
+        """
+        Evaluates an op, writing the array parts of the result into buffers (out= semantics) instead of allocating them.
+        Scalar parts are computed as usual, and ops without a buffered variant fall back to do.
+
+        :param op:      The op name.
+        :param buffer:  A callable (part, shape) -> array handing out the buffers of the result (see BufferPool).
+        :param args:    The inputs of the op.
+        :return:        The resulting dual number, whose parts may be views of the buffers.
+        """
+
+        if op not in self.into_ops:
+            return self.ops[op](*args)
+        return self.into_ops[op](buffer, *args)
+
 class DualNumber:
+    """
+    Dual number with a real part and a tangent (dual) part. The tangent part may be a scalar or a NumPy array of
+    lanes (one lane per variable, on the leading axis), in which case a single sweep propagates all the partial
+    derivatives at once. Arithmetic is lane-wise, so both forms share the same implementation.
+
+    The parts may themselves be dual numbers (nested, or hyper-dual numbers): seeding an inner tangent and an outer
+    tangent yields the second order derivative along both in the dual part of the dual part. The arithmetic only
+    relies on the operators of its parts, so any nesting depth works. NumPy arrays defer to the reflected operators of
+    dual numbers (i.e. array * dual is a dual number, not an object array).
+    """
+
+    __slots__ = ('real', 'dual')
+
+    __array_ufunc__ = None
 
     def __init__(self, real, dual):
         self.real = real
@@ -50,15 +107,187 @@ class DualNumber:
             dual = (self.real * other.dual) + (other.real * self.dual)
             return DualNumber(real, dual)
         else:
-            return DualNumber(self.real * other, self.dual)
+            return DualNumber(self.real * other, self.dual * other)
 
     def __truediv__(self, other):
         if isinstance(other, DualNumber):
             real = self.real / other.real
-            dual = ((-1) * self.real * (self.dual + other.dual)) / (other.real ** 2)
+            dual = ((self.dual * other.real) - (self.real * other.dual)) / (other.real ** 2)
             return DualNumber(real, dual)
         else:
-            return DualNumber(self.real / other, self.dual)
+            return DualNumber(self.real / other, self.dual / other)
+
+    def __radd__(self, other):
+        return DualNumber(other + self.real, self.dual)
+
+    def __rsub__(self, other):
+        return DualNumber(other - self.real, -self.dual)
+
+    def __rmul__(self, other):
+        return DualNumber(other * self.real, other * self.dual)
+
+    def __rtruediv__(self, other):
+        real = other / self.real
+        return DualNumber(real, -(real * self.dual) / self.real)
+
+    def __neg__(self):
+        return DualNumber(-self.real, -self.dual)
+
+    def __pow__(self, power):
+        # A power without tangent (e.g. a constant fed as a dual number) takes the power rule, s.t. negative bases do not
+        # go through their logarithm.
+        if isinstance(power, DualNumber) and not _has_tangent(power):
+            power = _primal(power)
+
+        if isinstance(power, DualNumber):
+            # (a^b)' = a^b * (b' * ln(a) + b * a' / a)
+            real = self.real ** power.real
+            dual = real * ((power.dual * _log(self.real)) + (power.real * self.dual / self.real))
+            return DualNumber(real, dual)
+        else:
+            return DualNumber(self.real ** power, power * (self.real ** (power - 1)) * self.dual)
+
+    def __rpow__(self, base):
+        real = base ** self.real
+        return DualNumber(real, real * np.log(base) * self.dual)
+
+
+class DualBatch:
+    """
+    Struct-of-arrays storage for the dual numbers of every plan slot over a batch of samples: one real array of shape
+    (slots, n) and one dual array of shape (slots, n), or (slots, lanes, n) for multi-lane duals. Per-sample sweep
+    results are written into it column by column instead of being kept as boxed dual numbers.
+
+    Indexing by node id returns a dual number whose parts are views of the node's rows.
+    """
+
+    __slots__ = ('slots', 'real', 'dual')
+
+    def __init__(self, slots, n, lanes=None):
+        """
+        :param slots:   Dict mapping node ids to their slot (i.e. row) index.
+        :param n:       The batch length.
+        :param lanes:   The number of tangent lanes, None for scalar duals.
+        """
+
+        self.slots = slots
+        self.real = np.zeros((len(slots), n))
+        self.dual = np.zeros((len(slots), n) if lanes is None else (len(slots), lanes, n))
+
+    def set_sample(self, i, slot_values):
+        """
+        Stores the dual numbers of one sweep.
+
+        :param i:               Index of the sample in the batch.
+        :param slot_values:     A list holding the dual number of every slot.
+        """
+
+        for slot, value in enumerate(slot_values):
+            self.real[slot, i] = value.real
+            self.dual[slot, ..., i] = value.dual
+
+    def __getitem__(self, node_id):
+        slot = self.slots[node_id]
+        return DualNumber(self.real[slot], self.dual[slot])
+
+    def __contains__(self, node_id):
+        return node_id in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def keys(self):
+        return self.slots.keys()
+
+
+def lane_seed(node_id, lane_ids, batched=False):
+    """
+    Builds the tangent seed of a variable for a multi-lane sweep.
+
+    :param node_id:     Id of the variable being seeded.
+    :param lane_ids:    Ids of the variables assigned to the tangent lanes, in lane order.
+    :param batched:     Whether the real parts span a batch. If so, the lanes are shaped s.t. they broadcast against it.
+    :return:            A one-hot lane vector if the variable has a lane, 0 otherwise.
+    """
+
+    if node_id not in lane_ids:
+        return 0
+
+    seed = np.zeros((len(lane_ids), 1) if batched else len(lane_ids))
+    seed[lane_ids.index(node_id)] = 1
+    return seed
+
+
+def _unary(a, kernel, derivative):
+    """
+    Applies an element-wise function to a number or a (nested) dual number: f(a + a'e) = f(a) + f'(a) a'e.
+
+    :param a:           The argument.
+    :param kernel:      The function over plain numbers/arrays.
+    :param derivative:  A function (real part, value at the real part) -> derivative at the real part. It must handle
+                        dual numbers itself, for nested duals.
+    :return:            The value of the function.
+    """
+
+    if isinstance(a, DualNumber):
+        value = _unary(a.real, kernel, derivative)
+        return DualNumber(value, derivative(a.real, value) * a.dual)
+    return kernel(a)
+
+
+def _primal(a):
+    # The innermost real part of a (nested) dual number.
+    while isinstance(a, DualNumber):
+        a = a.real
+    return a
+
+
+def _has_tangent(a):
+    # Whether some tangent part of a (nested) dual number is non-zero.
+    while isinstance(a, DualNumber):
+        if _is_nonzero(a.dual):
+            return True
+        a = a.real
+    return False
+
+
+def _is_nonzero(a):
+    if isinstance(a, DualNumber):
+        return _is_nonzero(a.real) or _is_nonzero(a.dual)
+    return bool(np.any(a))
+
+
+def _log(a):
+    # Natural logarithm of numbers and (nested) dual numbers.
+    return _unary(a, np.log, lambda r, v: 1 / r)
+
+
+def _exp(a):
+    return _unary(a, np.exp, lambda r, v: v)
+
+
+def _sqrt(a):
+    return _unary(a, np.sqrt, lambda r, v: 0.5 / v)
+
+
+def _sin(a):
+    return _unary(a, np.sin, lambda r, v: _cos(r))
+
+
+def _cos(a):
+    return _unary(a, np.cos, lambda r, v: -_sin(r))
+
+
+def _tanh(a):
+    return _unary(a, np.tanh, lambda r, v: 1 - v * v)
+
+
+def _logistic(a):
+    return _unary(a, kernels.logistic, lambda r, v: v * (1 - v))
+
+
+def _softplus(a):
+    return _unary(a, kernels.softplus, lambda r, v: _logistic(r))
 
 
 def _print_dual(a):
@@ -83,6 +312,42 @@ def _dual(a):
     return a.dual
 
 
+def _into(buffer, part, ufunc, *args):
+    # Applies the ufunc into the buffer part of the result shape, unless the result is a scalar.
+    shape = np.broadcast_shapes(*[np.shape(arg) for arg in args])
+    if shape == ():
+        return ufunc(*args)
+    return ufunc(*args, out=buffer(part, shape))
+
+
+def _dual_identity_into(buffer, a):
+    return DualNumber(_into(buffer, 'real', np.positive, a.real), _into(buffer, 'dual', np.positive, a.dual))
+
+
+def _dual_add_into(buffer, a, b):
+    return DualNumber(_into(buffer, 'real', np.add, a.real, b.real), _into(buffer, 'dual', np.add, a.dual, b.dual))
+
+
+def _dual_sub_into(buffer, a, b):
+    return DualNumber(_into(buffer, 'real', np.subtract, a.real, b.real),
+                      _into(buffer, 'dual', np.subtract, a.dual, b.dual))
+
+
+def _dual_mul_into(buffer, a, b):
+    real = _into(buffer, 'real', np.multiply, a.real, b.real)
+    left = _into(buffer, 'dual', np.multiply, a.real, b.dual)
+    right = _into(buffer, 'scratch', np.multiply, b.real, a.dual)
+    return DualNumber(real, _into(buffer, 'dual', np.add, left, right))
+
+
+def _dual_div_into(buffer, a, b):
+    # (a'b - ab') / b^2 = (a' - (a / b) b') / b
+    real = _into(buffer, 'real', np.divide, a.real, b.real)
+    scaled = _into(buffer, 'scratch', np.multiply, real, b.dual)
+    dual = _into(buffer, 'dual', np.subtract, a.dual, scaled)
+    return DualNumber(real, _into(buffer, 'dual', np.divide, dual, b.real))
+
+
 def _dual_add(a, b):
     return a + b
 
@@ -96,7 +361,7 @@ def _dual_mul(a, b):
 
 
 def _dual_sqrt(a):
-    pass
+    return _sqrt(a)
 
 
 def _dual_pow(a, power):
@@ -108,56 +373,70 @@ def _dual_div(a, b):
 
 
 def _dual_abs(a):
-    pass
+    # The derivative at 0 is taken as 0.
+    return _unary(a, np.abs, lambda r, v: np.sign(_primal(r)))
 
 
 def _dual_sin(a):
-    pass
+    return _sin(a)
 
 
 def _dual_cos(a):
-    pass
+    return _cos(a)
 
 
 def _dual_tan(a):
-    pass
+    return _unary(a, np.tan, lambda r, v: 1 + v * v)
 
 
 def _dual_tanh(a):
-    pass
+    return _tanh(a)
 
 
 def _dual_arctan(a):
-    pass
+    return _unary(a, np.arctan, lambda r, v: 1 / (1 + r * r))
 
 
 def _dual_logistic(a):
-    pass
+    return _logistic(a)
 
 
 def _dual_exp(a):
-    pass
+    return _exp(a)
 
 
 def _dual_log(a, base=10):
-    pass
+    return _log(a) / np.log(base)
 
 
 def _dual_ln(a):
-    pass
+    return _log(a)
 
 
 def _dual_erf(a):
-    pass
+    return _unary(a, kernels.erf, lambda r, v: (2 / np.sqrt(np.pi)) * _exp(-(r * r)))
 
 
 def _dual_gudermann(a):
-    pass
+    # gd'(a) = sech(a) = cos(gd(a))
+    return _unary(a, kernels.gudermann, lambda r, v: _cos(v))
 
 
 def _dual_softplus(a):
-    pass
+    return _softplus(a)
 
 
 def _dual_rectifier(a):
-    pass
+    return _unary(a, kernels.rectifier, lambda r, v: kernels.step(_primal(r)))
+
+
+def _dual_squared_error(a, b):
+    # Fused (a - b)^2: a single residual, no intermediate dual number.
+    residual = a.real - b.real
+    return DualNumber(residual * residual, 2 * residual * (a.dual - b.dual))
+
+
+def _dual_logistic_log_loss(logits, labels):
+    # Fused log-loss of logistic(z) against y, in the form softplus(z) - y z. d/dz = logistic(z) - y, d/dy = -z.
+    z, y = logits.real, labels.real
+    return DualNumber(_softplus(z) - y * z, ((_logistic(z) - y) * logits.dual) - (z * labels.dual))
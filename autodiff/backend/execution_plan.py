@@ -0,0 +1,182 @@
+class ExecutionPlan:
+    """
+    Linear form of a flattened computation graph. The nodes are ordered topologically and every node is assigned an
+    integer slot (its position in the order), s.t. a sweep is a single pass over the instruction list that reads its
+    inputs from, and writes its result to, a list of slot values.
+
+    Each instruction is a tuple (op, node id, input slots). The plan also records, for each instruction, the slots that
+    are no longer needed once it has run.
+
+    When target node ids are given, the plan only holds their ancestors (the nodes the targets depend on), s.t.
+    evaluating a sub-expression of a large graph costs only that sub-expression.
+    """
+
+    def __init__(self, graph, target_ids=None):
+        if target_ids is not None:
+            graph = subgraph(graph, ancestors(graph, target_ids))
+
+        self.target_ids = target_ids
+        self.node_ids = topological_order(graph)
+        self.slots = {node_id: slot for slot, node_id in enumerate(self.node_ids)}
+        self.instructions = [(graph[node_id]['op'],
+                              node_id,
+                              tuple(self.slots[input_id] for input_id in graph[node_id]['input_ids']))
+                             for node_id in self.node_ids]
+
+        # Liveness: frees[i] holds the slots whose last consumer is instruction i (i.e. that are dead after it).
+        # Slots without consumers (the targets) are never freed.
+        last_uses = {}
+        for slot, (_, _, input_slots) in enumerate(self.instructions):
+            for input_slot in input_slots:
+                last_uses[input_slot] = slot
+        self.frees = [[] for _ in self.instructions]
+        for input_slot, slot in last_uses.items():
+            self.frees[slot].append(input_slot)
+
+        self._levels = None
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __contains__(self, node_id):
+        return node_id in self.slots
+
+    def levels(self):
+        """
+        Groups the slots by dependency level: level 0 holds the input nodes, and every other node sits one level above
+        its deepest input. The nodes of a level do not depend on each other, s.t. they can be evaluated in any order
+        (or concurrently) once the lower levels are done.
+
+        :return:    A list of levels, each a list of slots in plan order.
+        """
+
+        if self._levels is None:
+            slot_levels = [0] * len(self.instructions)
+            for slot, (_, _, input_slots) in enumerate(self.instructions):
+                if len(input_slots) > 0:
+                    slot_levels[slot] = 1 + max(slot_levels[input_slot] for input_slot in input_slots)
+
+            self._levels = [[] for _ in range(max(slot_levels, default=-1) + 1)]
+            for slot, level in enumerate(slot_levels):
+                self._levels[level].append(slot)
+
+        return self._levels
+
+    def slot_dict(self, slot_values):
+        """
+        Maps the slot values produced by executing the plan back to node ids.
+
+        :param slot_values:  A list holding a value for every slot.
+        :return:             A dict mapping node ids to their values.
+        """
+
+        return dict(zip(self.node_ids, slot_values))
+
+
+def compile_plan(graph, target_node_id=None):
+    """
+    Builds the execution plan of a graph. Graphs that carry a <compiled> state dict (i.e. flattened graphs handed out
+    by the active section) keep their plans there, s.t. each is built once per graph.
+
+    :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param target_node_id:  If set, the plan is pruned to the nodes the target depends on. A tuple of node ids prunes it
+                            to the nodes any of them depends on.
+    :return:                The execution plan of the graph.
+    """
+
+    if target_node_id is None:
+        target_ids = None
+    elif isinstance(target_node_id, tuple):
+        target_ids = list(target_node_id)
+    else:
+        target_ids = [target_node_id]
+
+    compiled = getattr(graph, 'compiled', None)
+    if compiled is None:
+        return ExecutionPlan(graph, target_ids)
+
+    key = ('plan', target_node_id)
+    if key not in compiled:
+        compiled[key] = ExecutionPlan(graph, target_ids)
+
+    return compiled[key]
+
+
+def jacobian_costs(graph, output_ids, input_ids):
+    """
+    Estimates the cost of computing the Jacobian of the outputs w.r.t. the inputs in each accumulation mode, in node
+    evaluations: forward mode carries one tangent per input through every node the outputs depend on, while reverse
+    mode runs one adjoint pass per output over the nodes that output depends on.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param output_ids:  The ids of the nodes being differentiated.
+    :param input_ids:   The ids of the nodes to differentiate with respect to.
+    :return:            A dict mapping <forward> and <reverse> to their estimated cost.
+    """
+
+    return {
+        'forward': len(input_ids) * len(ancestors(graph, output_ids)),
+        'reverse': sum(len(ancestors(graph, [output_id])) for output_id in output_ids)
+    }
+
+
+def ancestors(graph, target_ids):
+    """
+    Collects the nodes the targets depend on (the targets included).
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param target_ids:  The ids of the target nodes.
+    :return:            A set of node ids.
+    """
+
+    reached = set(target_ids)
+    stack = list(target_ids)
+    while len(stack) > 0:
+        for input_id in graph[stack.pop()]['input_ids']:
+            if input_id not in reached:
+                reached.add(input_id)
+                stack.append(input_id)
+
+    return reached
+
+
+def subgraph(graph, node_ids):
+    """
+    Restricts the graph to the given nodes, dropping the edges to nodes outside of it.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param node_ids:    The nodes to keep. Must contain the inputs of every kept node.
+    :return:            The computation graph of the kept nodes.
+    """
+
+    return {node_id: {'op': graph[node_id]['op'],
+                      'input_ids': graph[node_id]['input_ids'],
+                      'output_ids': [output_id for output_id in graph[node_id]['output_ids'] if output_id in node_ids]}
+            for node_id in node_ids}
+
+
+def topological_order(graph):
+    """
+    Orders the graph nodes s.t. every node comes after all of its inputs (Kahn's algorithm).
+
+    :param graph:   Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :return:        A list of node ids.
+    """
+
+    pending_inputs = {node_id: len(node['input_ids']) for node_id, node in graph.items()}
+    ready = [node_id for node_id, pending in pending_inputs.items() if pending == 0]
+
+    order = []
+    while len(ready) > 0:
+        node_id = ready.pop()
+        order.append(node_id)
+
+        for output_id in graph[node_id]['output_ids']:
+            pending_inputs[output_id] -= 1
+            if pending_inputs[output_id] == 0:
+                ready.append(output_id)
+
+    if len(order) != len(graph):
+        raise ValueError('The computation graph contains a cycle.')
+
+    return order
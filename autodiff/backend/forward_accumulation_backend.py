@@ -1,5 +1,9 @@
 import numpy as np
-from autodiff.backend.dual_number_engine import DualNumberEngine
+from autodiff.backend.dual_number_engine import DualNumberEngine, DualNumber, DualBatch, lane_seed
+from autodiff.backend.execution_plan import compile_plan
+from autodiff.backend.memory_plan import MemoryPlan, BufferPool
+from autodiff.backend.reducers import batch_length, make_reducer, make_streaming_reducer
+from autodiff.shapes import check_scalar_graph
 
 
 class ForwardAccumulationBackend:
@@ -14,15 +18,108 @@ class ForwardAccumulationBackend:
             dual(v) = 0
 
         return gradient
+
+        In vectorized mode, the feeders are fed as arrays spanning the entire batch, s.t. the real and dual parts of
+        every node are arrays and a single sweep covers the batch (instead of one sweep per sample).
+
+        With lanes set to k, the dual parts are vectors of k lanes and each sweep differentiates w.r.t. k variables at
+        once (every variable in the chunk is seeded with a one-hot lane vector). Setting k to at least the number of
+        variables yields the full gradient in a single sweep, while smaller values bound the memory of the tangents.
+
+        In streaming mode, memory is bounded by the width of the graph instead of its size: the value of a node is
+        released as soon as its last consumer has run, only the target node is retained, and the batch is processed in
+        chunks of <chunk_size> samples whose results are reduced online (the median is approximated with a P-square
+        sketch).
+
+        With reuse_buffers set in vectorized mode, the op results are written into a fixed pool of preallocated arrays
+        (see MemoryPlan), assigned by liveness and kept with the compiled graph, s.t. repeated sweeps over the same graph
+        (i.e. every optimizer step) run without allocating temporaries. Only the target node is returned.
+
+        With an executor (see LevelExecutor) in vectorized mode, the sweeps go through the plan level by level, the
+        independent nodes of each level being evaluated concurrently. Streaming and buffer reuse rely on the sequential
+        order of the plan, so they cannot be combined with an executor. The backend owns the executor, whose threads
+        are stopped by close (or on leaving a with block over the backend).
     """
 
-    def __init__(self):
+    def __init__(self, vectorized=False, lanes=None, streaming=False, chunk_size=1024, reuse_buffers=False,
+                 executor=None):
+        if (lanes is not None) and (lanes < 1):
+            raise ValueError('The number of lanes must be positive. Got {}.'.format(lanes))
+        if chunk_size < 1:
+            raise ValueError('The chunk size must be positive. Got {}.'.format(chunk_size))
+        if (executor is not None) and ((not vectorized) or streaming or reuse_buffers):
+            raise ValueError('Parallel sweeps need vectorized mode, without streaming nor buffer reuse.')
+
         self.engine = None
+        self._compiled_graph = None
+        self._plans = {}
+        self._memory = {}
+        self.vectorized = vectorized
+        self.lanes = lanes
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.reuse_buffers = reuse_buffers
+        self.executor = executor
         self.name = 'forward-acc'
+        self.supports_tensors = False
 
     def init_capabilities(self, ops_set):
         self.engine = DualNumberEngine(ops_set)
 
+    def close(self):
+        """
+        Shuts down the thread pool of the executor, if any. The backend owns the executor it was given, and the caller
+        owns the backend (registering it into a section does not transfer it), s.t. the caller closes the backend, or
+        uses it in a with block, once done with it.
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def compile(self, graph, target_node_id=None):
+        """
+        Compiles the graph into an execution plan. The plans of the last compiled graph are kept, s.t. repeated sweeps
+        over the same graph object (i.e. every sample, variable and optimizer step) reuse them.
+
+        :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:  If set, the plan is pruned to the nodes the target depends on.
+        :return:                The execution plan of the graph.
+        """
+
+        if self._compiled_graph is not graph:
+            check_scalar_graph(graph, self.name)
+            self._compiled_graph = graph
+            self._plans = {}
+            self._memory = {}
+
+        if target_node_id not in self._plans:
+            self._plans[target_node_id] = compile_plan(graph, target_node_id)
+
+        return self._plans[target_node_id]
+
+    def memory(self, graph, target_node_id):
+        """
+        Plans the buffers of the graph for the target node. Like the execution plans, the memory plans and their buffer
+        pools are kept for the last compiled graph.
+
+        :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:  The node being evaluated.
+        :return:                A tuple (memory plan, buffer pool).
+        """
+
+        plan = self.compile(graph, target_node_id)
+        if target_node_id not in self._memory:
+            self._memory[target_node_id] = (MemoryPlan(plan), BufferPool())
+
+        return self._memory[target_node_id]
+
     def values(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict):
         """
         Computes the values for the specified node using forward accumulation.
@@ -35,9 +132,11 @@ class ForwardAccumulationBackend:
         :return:                    A list of values for all input values.
         """
 
-        variable_id = list(variable_feed_dict.keys())[0]
-        node_duals = self.batch_forward_sweep(graph, variable_id, constant_feed_dict, variable_feed_dict, feed_dict)
-        target_values = [d.real for d in node_duals[target_node_id]]
+        target_values = []
+        for feed_chunk, n in self._feed_chunks(feed_dict):
+            node_duals = self.batch_forward_sweep(graph, None, constant_feed_dict, variable_feed_dict, feed_chunk,
+                                                  target_node_id)
+            target_values += np.broadcast_to(node_duals[target_node_id].real, (n,)).tolist()
 
         return target_values
 
@@ -56,110 +155,390 @@ class ForwardAccumulationBackend:
                                     a gradient or list of gradients (if reduce strategy is set to None).
         """
 
-        # Select reduce strategy based on parameter:
-        if reduce_strategy == 'avg':
-            reducer = np.mean
-        elif reduce_strategy == 'median':
-            reducer = np.median
-        elif reduce_strategy is None:
-            def _nop(x): return x
-            reducer = _nop
-        else:
-            raise NotImplementedError('Reduce strategy {} is not implemented.'.format(reduce_strategy))
+        return self._gradients(graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, reduce_strategy)
+
+    def value_and_gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                            reduce_strategy):
+        """
+        Computes both the values of the target node and the gradients for the variable nodes. The values are the real
+        parts of the first gradient sweep, s.t. no separate value sweep is run.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the value and the derivative.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing a set of gradients.
+                                    Supports <avg>, <median>, <None> - returns list of gradients.
+        :return:                    A tuple (list of values for all input values, map of variable ids to gradients).
+        """
+
+        target_values = []
+        variable_gradient_map = self._gradients(graph, target_node_id, feed_dict, variable_feed_dict,
+                                                constant_feed_dict, reduce_strategy, target_values)
+
+        return target_values, variable_gradient_map
+
+    def _gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, reduce_strategy,
+                   target_values=None):
+        """
+        Computes the gradients for the variable nodes. If a <target_values> list is given, the values of the target are
+        appended to it.
+        """
+
+        if self.streaming:
+            return self._streaming_gradients(graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                                             reduce_strategy, target_values)
+
+        reducer = make_reducer(reduce_strategy)
+
+        n = batch_length(feed_dict)
+        plan = self.compile(graph, target_node_id)
+
+        # Variables that cannot reach the target have null gradients and need no sweep.
+        variable_gradient_map = {variable_id: reducer(np.zeros(n))
+                                 for variable_id in variable_feed_dict.keys() if variable_id not in plan}
+        reaching_variable_ids = [variable_id for variable_id in variable_feed_dict.keys() if variable_id in plan]
+
+        if (target_values is not None) and (len(reaching_variable_ids) == 0):
+            target_values += self.values(graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict)
+
+        for i, active_variable_id in enumerate(self._variable_chunks(reaching_variable_ids)):
+            node_duals = self.batch_forward_sweep(graph, active_variable_id, constant_feed_dict, variable_feed_dict,
+                                                  feed_dict, target_node_id)
+            if (target_values is not None) and (i == 0):
+                target_values += np.broadcast_to(node_duals[target_node_id].real, (n,)).tolist()
+            for variable_id, target_gradients in self._target_gradients(node_duals[target_node_id], active_variable_id,
+                                                                        n):
+                variable_gradient_map[variable_id] = reducer(target_gradients)
+
+        return {variable_id: variable_gradient_map[variable_id] for variable_id in variable_feed_dict.keys()}
+
+    def _streaming_gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                             reduce_strategy, target_values=None):
+        """
+        Computes the gradients chunk by chunk, feeding the per-sample gradients of every chunk to online reducers.
+        """
+
+        plan = self.compile(graph, target_node_id)
+        reducers = {variable_id: make_streaming_reducer(reduce_strategy) for variable_id in variable_feed_dict.keys()}
+        reaching_variable_ids = [variable_id for variable_id in variable_feed_dict.keys() if variable_id in plan]
+
+        for feed_chunk, n in self._feed_chunks(feed_dict):
+            for variable_id in variable_feed_dict.keys():
+                if variable_id not in plan:
+                    reducers[variable_id].update(np.zeros(n))
+
+            if (target_values is not None) and (len(reaching_variable_ids) == 0):
+                node_duals = self.batch_forward_sweep(graph, None, constant_feed_dict, variable_feed_dict, feed_chunk,
+                                                      target_node_id)
+                target_values += np.broadcast_to(node_duals[target_node_id].real, (n,)).tolist()
+
+            for i, active_variable_id in enumerate(self._variable_chunks(reaching_variable_ids)):
+                node_duals = self.batch_forward_sweep(graph, active_variable_id, constant_feed_dict,
+                                                      variable_feed_dict, feed_chunk, target_node_id)
+                if (target_values is not None) and (i == 0):
+                    target_values += np.broadcast_to(node_duals[target_node_id].real, (n,)).tolist()
+                for variable_id, target_gradients in self._target_gradients(node_duals[target_node_id],
+                                                                            active_variable_id, n):
+                    reducers[variable_id].update(target_gradients)
+
+        return {variable_id: reducer.result() for variable_id, reducer in reducers.items()}
+
+    def hessian_vector_product(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, vector,
+                               reduce_strategy='avg'):
+        """
+        Computes the product of the Hessian of the target w.r.t. the variables with a vector, without forming the
+        Hessian (forward-over-forward: the inner tangent is seeded with the vector, the outer one with the variables).
+        This takes one nested sweep per variable, or per chunk of <lanes> variables, unlike the forward-over-reverse
+        product of ReverseAccumulationBackend.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node being differentiated.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param vector:              Dict mapping variable ids to the entries of the vector (missing entries are 0).
+        :param reduce_strategy:     Method of processing the per-sample products.
+                                    Supports <avg>, <median>, <None> - returns list of products.
+        :return:                    A map that connects variable ids to their entry of the product.
+        """
+
+        inner_seeds = {variable_id: vector.get(variable_id, 0.0) for variable_id in variable_feed_dict.keys()}
+        return self._second_order(graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                                  inner_seeds, reduce_strategy)
+
+    def hessian_diagonal(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                         reduce_strategy='avg'):
+        """
+        Computes the diagonal of the Hessian of the target w.r.t. the variables, without forming the Hessian (both
+        tangents are seeded with the same variable; with lanes, every lane carries its own variable).
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node being differentiated.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing the per-sample second derivatives.
+                                    Supports <avg>, <median>, <None> - returns list of second derivatives.
+        :return:                    A map that connects variable ids to their second derivative.
+        """
+
+        return self._second_order(graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, None,
+                                  reduce_strategy)
 
-        variable_gradient_map = {}
-        for variable_id in variable_feed_dict.keys():
-            node_duals = self.batch_forward_sweep(graph, variable_id, constant_feed_dict, variable_feed_dict, feed_dict)
-            target_gradients = [d.dual for d in node_duals[target_node_id]]
+    def jacobian(self, graph, output_ids, input_ids, feed_dict, variable_feed_dict, constant_feed_dict):
+        """
+        Computes the per-sample Jacobian of several output nodes w.r.t. several input nodes (variables or feeders) in
+        forward mode: the inputs are seeded on tangent lanes (at most <lanes> per sweep, all of them by default) and
+        a single batched sweep over the nodes the outputs depend on yields the columns of all the outputs at once.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param output_ids:          The ids of the nodes being differentiated.
+        :param input_ids:           The ids of the variable/feeder nodes to differentiate with respect to.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :return:                    An array of shape (outputs, inputs, batch length).
+        """
 
-            variable_gradient_map[variable_id] = reducer(target_gradients)
+        n = batch_length(feed_dict) if len(feed_dict) > 0 else 1
+        plan = self.compile(graph, tuple(output_ids))
+        feed = {k: np.asarray(v[:n], dtype=float) for k, v in feed_dict.items()}
 
-        return variable_gradient_map
+        lanes = len(input_ids) if self.lanes is None else self.lanes
+        jacobian = np.zeros((len(output_ids), len(input_ids), n))
+        for start in range(0, len(input_ids), lanes):
+            lane_ids = list(input_ids[start:start + lanes])
+            slot_values = self._sweep_slots(plan, lane_ids, constant_feed_dict, variable_feed_dict, feed, batched=True)
+            for i, output_id in enumerate(output_ids):
+                jacobian[i, start:start + len(lane_ids)] = np.broadcast_to(slot_values[plan.slots[output_id]].dual,
+                                                                           (len(lane_ids), n))
 
-    def batch_forward_sweep(self, graph, active_variable_id, constant_feed, variable_feed, feeder_batch):
+        return jacobian
+
+    def _second_order(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, inner_seeds,
+                      reduce_strategy):
+        """
+        Runs nested dual sweeps, the outer tangent being seeded like a gradient sweep, and reduces the second order part
+        of the target. The inner tangents are seeded with <inner_seeds>, or like the outer ones if None. The sweeps are
+        always batched (feeders as arrays).
         """
-        Performs a series of sweeps of the computation graph, one for each input configuration of the feeders.
+
+        reducer = make_reducer(reduce_strategy)
+
+        n = batch_length(feed_dict)
+        plan = self.compile(graph, target_node_id)
+        feed = {k: np.asarray(v[:n], dtype=float) for k, v in feed_dict.items()}
+
+        variable_gradient_map = {variable_id: reducer(np.zeros(n))
+                                 for variable_id in variable_feed_dict.keys() if variable_id not in plan}
+        reaching_variable_ids = [variable_id for variable_id in variable_feed_dict.keys() if variable_id in plan]
+
+        for active_variable_id in self._variable_chunks(reaching_variable_ids):
+            if inner_seeds is None:
+                nested_feed = {variable_id: DualNumber(value, self._variable_seed(variable_id, active_variable_id, True))
+                               for variable_id, value in variable_feed_dict.items()}
+            else:
+                nested_feed = {variable_id: DualNumber(value, inner_seeds[variable_id])
+                               for variable_id, value in variable_feed_dict.items()}
+
+            slot_values = self._sweep_slots(plan, active_variable_id, constant_feed_dict, nested_feed, feed,
+                                            batched=True)
+            target_dual = slot_values[plan.slots[target_node_id]].dual
+
+            # Without any contribution of the inner tangent, the outer tangent is a plain value.
+            second_order = target_dual.dual if isinstance(target_dual, DualNumber) else 0.0
+            for variable_id, target_gradients in self._target_gradients(DualNumber(0.0, second_order),
+                                                                        active_variable_id, n):
+                variable_gradient_map[variable_id] = reducer(target_gradients)
+
+        return {variable_id: variable_gradient_map[variable_id] for variable_id in variable_feed_dict.keys()}
+
+    def _target_gradients(self, target_dual, active_variable_id, n):
+        """
+        Splits the dual part of the target over the variables of a sweep unit.
+
+        :return:    A list of tuples (variable id, gradients of the target over the batch).
+        """
+
+        if self.lanes is None:
+            return [(active_variable_id, np.broadcast_to(target_dual.dual, (n,)))]
+
+        lane_gradients = np.broadcast_to(target_dual.dual, (len(active_variable_id), n))
+        return [(variable_id, lane_gradients[lane]) for lane, variable_id in enumerate(active_variable_id)]
+
+    def _feed_chunks(self, feed_dict):
+        """
+        Splits the feed into the batches processed by one batch sweep: the whole feed, or consecutive chunks of at most
+        <chunk_size> samples in streaming mode.
+
+        :return:    A list of tuples (feed dict of the chunk, chunk length).
+        """
+
+        n = batch_length(feed_dict)
+        if not self.streaming:
+            return [(feed_dict, n)]
+
+        return [({k: v[start:start + self.chunk_size] for k, v in feed_dict.items()}, min(self.chunk_size, n - start))
+                for start in range(0, n, self.chunk_size)]
+
+    def _variable_chunks(self, variable_ids):
+        """
+        Splits the variables into the units differentiated by one batch sweep: single variable ids when sweeping
+        scalar duals, lists of at most <lanes> variable ids when sweeping multi-lane duals.
+        """
+
+        if self.lanes is None:
+            return variable_ids
+
+        return [variable_ids[i:i + self.lanes] for i in range(0, len(variable_ids), self.lanes)]
+
+    def _variable_seed(self, node_id, active_variable_id, batched=None):
+        if active_variable_id is None:
+            return 0
+
+        if not isinstance(active_variable_id, list):
+            return int(node_id == active_variable_id)
+
+        return lane_seed(node_id, active_variable_id, batched=self.vectorized if batched is None else batched)
+
+    def batch_forward_sweep(self, graph, active_variable_id, constant_feed, variable_feed, feeder_batch,
+                            target_node_id=None):
+        """
+        Performs the sweeps of the computation graph for every input configuration of the feeders. In vectorized mode
+        this is a single sweep over arrays, otherwise it is a series of sweeps, one for each input configuration.
 
         :param graph:                   The computation graph.
-        :param active_variable_id:      The id of the current variable considered for differentiation.
+        :param active_variable_id:      The id of the current variable considered for differentiation
+                                        (a list of variable ids, one per lane, when sweeping multi-lane duals,
+                                        None when only the values are needed).
         :param constant_feed:           A dict mapping constant ids to their constant value.
         :param variable_feed:           A dict mapping variable ids to their current value.
         :param feeder_batch:            A dict mapping feeder ids to a list of their input values.
-        :return:                        A dict mapping all graph node ids to a list of resulting dual numbers.
+        :param target_node_id:          If set, only the nodes the target depends on are evaluated.
+        :return:                        A mapping from the evaluated node ids to a dual number whose real and dual
+                                        parts hold the results for the whole batch on their last axis (scalars for
+                                        nodes not fed by feeders). Lanes, if any, are on the leading axis of the dual
+                                        part. Per-sample sweeps are stored in a DualBatch. In streaming mode, only
+                                        the target node is kept (likewise when reusing buffers).
         """
 
-        # Pick the minimum of the feed lists to represent the entire feed dict.
-        n = min([len(vals) for feeder_id, vals in feeder_batch.items()])
+        n = batch_length(feeder_batch)
 
-        # Build a list of feed dicts.
-        feed_dicts = [{k: v[i] for k, v in feeder_batch.items()} for i in range(n)]
+        if self.vectorized:
+            feed = {k: np.asarray(v[:n], dtype=float) for k, v in feeder_batch.items()}
+            return self.sweep(graph, active_variable_id, constant_feed, variable_feed, feed, target_node_id)
 
-        # Gather results from consecutive forward sweeps.
-        sweep_results = [self.sweep(graph, active_variable_id, constant_feed, variable_feed, feed_dicts[i])
-                         for i in range(n)]
+        plan = self.compile(graph, target_node_id)
+        lanes = None if (self.lanes is None) or (active_variable_id is None) else len(active_variable_id)
 
-        # Build lists of dual numbers for each node.
-        graph_dual_map = {}
-        for graph_result in sweep_results:
-            for k, v in graph_result.items():
-                if k not in graph_dual_map:
-                    graph_dual_map[k] = []
+        # Gather results from consecutive forward sweeps, straight into batch arrays.
+        kept_slots = plan.slots
+        if self.streaming and (target_node_id is not None):
+            kept_slots = {target_node_id: plan.slots[target_node_id]}
 
-                graph_dual_map[k].append(v)
+        dual_batch = DualBatch({node_id: row for row, node_id in enumerate(kept_slots.keys())}, n, lanes)
+        for i in range(n):
+            feeder_feed = {k: v[i] for k, v in feeder_batch.items()}
+            slot_values = self._sweep_slots(plan, active_variable_id, constant_feed, variable_feed, feeder_feed)
+            dual_batch.set_sample(i, [slot_values[slot] for slot in kept_slots.values()])
 
-        return graph_dual_map
+        return dual_batch
 
-    def sweep(self, graph, active_variable_id, constant_feed, variable_feed, feeder_feed):
+    def sweep(self, graph, active_variable_id, constant_feed, variable_feed, feeder_feed, target_node_id=None):
         """
         Performs a forward sweep of the computation graph. The function returns the dual values for the entire
         computation graph s.t. it can be used for both gradient computation and function evaluation.
 
         :param graph:                   The computation graph.
-        :param active_variable_id:      The id of the current variable considered for differentiation.
+        :param active_variable_id:      The id of the current variable considered for differentiation
+                                        (a list of variable ids, one per lane, when sweeping multi-lane duals,
+                                        None when only the values are needed).
         :param constant_feed:           A dict mapping constant ids to their constant value.
         :param variable_feed:           A dict mapping variable ids to their current value.
         :param feeder_feed:             A dict mapping feeder ids to their input value.
-        :return:                        A dict mapping all graph node ids to their resulting dual numbers.
-        """
-
-        # Used to mark variables/constants/feeders as ready from the start (i.e. automatically add them to the queue.
-        graph_input_ids = set(constant_feed.keys()).union(set(variable_feed.keys())).union(set(feeder_feed.keys()))
-
-        # We store the computed node values here.
-        node_values = {}
-
-        # In forward sweeps, we must consider all inputs to the graph.
-        eval_queue = list(graph_input_ids)
-        while len(eval_queue) > 0:
-            node_id = eval_queue[0]
-            node = graph[node_id]
-            eval_queue = eval_queue[1:]
-
-            if node_id not in node_values.keys():
-                # A node is ready when all it's incoming edges have been evaluated.
-                node_is_ready = (node_id in graph_input_ids) or \
-                                (all([incoming_id in node_values for incoming_id in node['input_ids']]))
-
-                if node_is_ready:
-                    # Evaluate the node
-                    if node['op'] == 'feeder':
-                        node_values[node_id] = self.engine.do('feeder', feeder_feed[node_id])
-                    elif node['op'] == 'constant':
-                        node_values[node_id] = self.engine.do('constant', constant_feed[node_id])
-                    elif node['op'] == 'variable':
-                        # Set the seed of the variable.
-                        seed = int(node_id == active_variable_id)
-                        node_values[node_id] = self.engine.do('variable', variable_feed[node_id], seed)
-                    else:
-                        # Generic op. Gather incoming values and eval.
-                        incoming_values = [node_values[input_id] for input_id in node['input_ids']]
-                        node_values[node_id] = self.engine.do(node['op'], *incoming_values)
-
-                    # Enqueue nodes downstream.
-                    eval_queue += node['output_ids']
+        :param target_node_id:          If set, only the nodes the target depends on are evaluated.
+        :return:                        A dict mapping all evaluated graph node ids to their resulting dual numbers
+                                        (only the target node in streaming mode or when reusing buffers).
+        """
 
+        plan = self.compile(graph, target_node_id)
+
+        if self.vectorized and self.reuse_buffers and (target_node_id is not None):
+            slot_values = self._sweep_slots(plan, active_variable_id, constant_feed, variable_feed, feeder_feed,
+                                            self.memory(graph, target_node_id))
+            # The buffers are overwritten by the next sweep. Hand out a copy of the target.
+            target_value = slot_values[plan.slots[target_node_id]]
+            return {target_node_id: DualNumber(np.array(target_value.real), np.array(target_value.dual))}
+
+        slot_values = self._sweep_slots(plan, active_variable_id, constant_feed, variable_feed, feeder_feed)
+
+        if self.streaming and (target_node_id is not None):
+            return {target_node_id: slot_values[plan.slots[target_node_id]]}
+        return plan.slot_dict(slot_values)
+
+    def _sweep_slots(self, plan, active_variable_id, constant_feed, variable_feed, feeder_feed, memory=None,
+                     batched=None):
+        if self.executor is not None:
+            return self._level_sweep_slots(plan, active_variable_id, constant_feed, variable_feed, feeder_feed,
+                                           batched)
+
+        # Slot values, in plan order. All the inputs of an instruction are evaluated before it.
+        slot_values = [None] * len(plan)
+        for slot, (op, node_id, input_slots) in enumerate(plan.instructions):
+            if op in ('feeder', 'constant', 'variable'):
+                slot_values[slot] = self._input_value(op, node_id, active_variable_id, constant_feed, variable_feed,
+                                                      feeder_feed, batched)
+            else:
+                # Generic op. Gather incoming values and eval.
+                inputs = [slot_values[input_slot] for input_slot in input_slots]
+                if memory is None:
+                    slot_values[slot] = self.engine.do(op, *inputs)
                 else:
-                    # Re-enqueue the node's dependencies.
-                    eval_queue += node['input_ids']
-
-        return node_values
+                    memory_plan, pool = memory
+                    slot_values[slot] = self.engine.do_into(op, pool.buffer(memory_plan.buffers[slot]), *inputs)
+
+            if self.streaming:
+                # Release the values no longer needed by the remaining instructions.
+                for dead_slot in plan.frees[slot]:
+                    slot_values[dead_slot] = None
+
+        return slot_values
+
+    def _level_sweep_slots(self, plan, active_variable_id, constant_feed, variable_feed, feeder_feed, batched=None):
+        # Same as _sweep_slots, level by level: the ops of a level only read the values of the lower levels.
+        levels = plan.levels()
+        slot_values = [None] * len(plan)
+        for slot in (levels[0] if len(levels) > 0 else []):
+            op, node_id, _ = plan.instructions[slot]
+            slot_values[slot] = self._input_value(op, node_id, active_variable_id, constant_feed, variable_feed,
+                                                  feeder_feed, batched)
+
+        # Every op processes the batch, once per lane.
+        lanes = len(active_variable_id) if isinstance(active_variable_id, list) else 1
+        work_size = lanes * max([np.size(value) for value in feeder_feed.values()], default=1)
+
+        def evaluate(slot):
+            op, _, input_slots = plan.instructions[slot]
+            return self.engine.do(op, *[slot_values[input_slot] for input_slot in input_slots])
+
+        for level in levels[1:]:
+            for slot, value in zip(level, self.executor.map(evaluate, level, work_size)):
+                slot_values[slot] = value
+
+        return slot_values
+
+    def _input_value(self, op, node_id, active_variable_id, constant_feed, variable_feed, feeder_feed, batched):
+        if op == 'feeder':
+            # Feeders are only seeded when differentiating w.r.t. them (see jacobian).
+            seed = self._variable_seed(node_id, active_variable_id, batched)
+            if isinstance(seed, int) and (seed == 0):
+                return self.engine.do('feeder', feeder_feed[node_id])
+            return self.engine.do('variable', feeder_feed[node_id], seed)
+        elif op == 'constant':
+            return self.engine.do('constant', constant_feed[node_id])
+        else:
+            # Set the seed of the variable.
+            seed = self._variable_seed(node_id, active_variable_id, batched)
+            return self.engine.do('variable', variable_feed[node_id], seed)
@@ -0,0 +1,129 @@
+import math
+
+import numpy as np
+
+
+# Element-wise kernels shared by the engines (and the generated code). They operate on scalars and whole batch arrays
+# alike, through NumPy ufuncs, and are written s.t. they do not overflow for large inputs.
+
+_TWO_OVER_SQRT_PI = 2 / math.sqrt(math.pi)
+_ONE_OVER_SQRT_PI = 1 / math.sqrt(math.pi)
+
+# Coefficients of the rational approximations of erf/erfc by W. J. Cody, Math. Comp. 23 (1969), on |x| <= 0.5,
+# 0.5 < |x| <= 4 and |x| > 4. They are accurate to about double precision.
+_ERF_SMALL_P = (3.16112374387056560e00, 1.13864154151050156e02, 3.77485237685302021e02, 3.20937758913846947e03,
+                1.85777706184603153e-1)
+_ERF_SMALL_Q = (2.36012909523441209e01, 2.44024637934444173e02, 1.28261652607737228e03, 2.84423683343917062e03)
+_ERFC_MEDIUM_P = (5.64188496988670089e-1, 8.88314979438837594e00, 6.61191906371416295e01, 2.98635138197400131e02,
+                  8.81952221241769090e02, 1.71204761263407058e03, 2.05107837782607147e03, 1.23033935479799725e03,
+                  2.15311535474403846e-8)
+_ERFC_MEDIUM_Q = (1.57449261107098347e01, 1.17693950891312499e02, 5.37181101862009858e02, 1.62138957456669019e03,
+                  3.29079923573345963e03, 4.36261909014324716e03, 3.43936767414372164e03, 1.23033935480374942e03)
+_ERFC_LARGE_P = (3.05326634961232344e-1, 3.60344899949804439e-1, 1.25781726111229246e-1, 1.60837851487422766e-2,
+                 6.58749161529837803e-4, 1.63153871373020978e-2)
+_ERFC_LARGE_Q = (2.56852019228982242e00, 1.87295284992346725e00, 5.27905102951428412e-1, 6.05183413124413191e-2,
+                 2.33520497626869185e-3)
+
+
+def logistic(a):
+    # 1 / (1 + exp(-a)), computed as exp(-log(1 + exp(-a))).
+    return np.exp(-np.logaddexp(0, -a))
+
+
+def softplus(a):
+    # log(1 + exp(a))
+    return np.logaddexp(0, a)
+
+
+def rectifier(a):
+    return np.maximum(a, 0.0)
+
+
+def step(a):
+    # Derivative of the rectifier (0 at the kink).
+    return np.heaviside(a, 0.0)
+
+
+def erf(a):
+    if np.ndim(a) == 0:
+        return math.erf(a)
+
+    a = np.asarray(a, dtype=np.float64)
+    y = np.abs(a)
+    result = np.empty_like(y)
+
+    # Each region is evaluated on its own elements only. Beyond 6, erfc is below half the float64 epsilon and erf
+    # rounds to 1. NaNs are in no region and are set last.
+    small = y <= 0.5
+    medium = (y > 0.5) & (y <= 4.0)
+    large = (y > 4.0) & (y < 6.0)
+    result[small] = _erf_small(y[small])
+    result[medium] = 1 - _erfc_medium(y[medium])
+    result[large] = 1 - _erfc_large(y[large])
+    result[y >= 6.0] = 1.0
+    result[np.isnan(y)] = np.nan
+
+    return np.copysign(result, a)
+
+
+def _erf_small(y):
+    # erf(y) = y P(y^2) / Q(y^2)
+    p, q = _ERF_SMALL_P, _ERF_SMALL_Q
+    y_squared = y * y
+    numerator = p[4] * y_squared
+    denominator = y_squared
+    for i in range(3):
+        numerator = (numerator + p[i]) * y_squared
+        denominator = (denominator + q[i]) * y_squared
+    return y * (numerator + p[3]) / (denominator + q[3])
+
+
+def _erfc_medium(y):
+    # erfc(y) = exp(-y^2) P(y) / Q(y)
+    p, q = _ERFC_MEDIUM_P, _ERFC_MEDIUM_Q
+    numerator = p[8] * y
+    denominator = y
+    for i in range(7):
+        numerator = (numerator + p[i]) * y
+        denominator = (denominator + q[i]) * y
+    return _exp_minus_square(y) * (numerator + p[7]) / (denominator + q[7])
+
+
+def _erfc_large(y):
+    # erfc(y) = exp(-y^2) / y (1 / sqrt(pi) + 1 / y^2 P(1 / y^2) / Q(1 / y^2))
+    p, q = _ERFC_LARGE_P, _ERFC_LARGE_Q
+    inverse_squared = 1 / (y * y)
+    numerator = p[5] * inverse_squared
+    denominator = inverse_squared
+    for i in range(4):
+        numerator = (numerator + p[i]) * inverse_squared
+        denominator = (denominator + q[i]) * inverse_squared
+    tail = inverse_squared * (numerator + p[4]) / (denominator + q[4])
+    return _exp_minus_square(y) * (_ONE_OVER_SQRT_PI - tail) / y
+
+
+def _exp_minus_square(y):
+    # exp(-y^2), with y^2 split into an exactly representable part and a small remainder to limit the rounding error.
+    head = np.trunc(y * 16) / 16
+    return np.exp(-head * head) * np.exp(-(y - head) * (y + head))
+
+
+def erf_derivative(a):
+    return _TWO_OVER_SQRT_PI * np.exp(-np.square(a))
+
+
+def gudermann(a):
+    return 2 * np.arctan(np.tanh(a / 2))
+
+
+def squared_error(a, b):
+    return np.square(a - b)
+
+
+def logistic_log_loss(logits, labels):
+    """
+    Log-loss of the logistic of the logits, -(y log(s) + (1 - y) log(1 - s)) with s = logistic(z), in the form
+    softplus(z) - y z, which stays finite for saturated logistics.
+    """
+
+    return softplus(logits) - labels * logits
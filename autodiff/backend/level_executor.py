@@ -0,0 +1,106 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LevelExecutor:
+    """
+    Evaluates the nodes of a dependency level (see ExecutionPlan.levels) concurrently on a thread pool. The nodes of a
+    level are independent, so their ops can run at the same time, and NumPy releases the GIL inside the array kernels,
+    s.t. wide graphs over large arrays (e.g. ensembles of sub-models) use several cores within a single sweep.
+
+    The nodes of a level are split into tasks of at least <min_work_size> elements (node count x work size per node),
+    and at most one task per worker. Levels too small to fill two tasks are evaluated on the calling thread, since
+    dispatching them would cost more than it saves.
+
+    The pool is created on first use and is not pickled with the executor (e.g. when shipping a backend to a worker).
+    Its threads live until shutdown is called, either directly, on leaving a with block over the executor, or by
+    closing the backend the executor was handed to (see ReverseAccumulationBackend.close). The pool is created again
+    on the next parallel level, s.t. a shut down executor remains usable.
+    """
+
+    def __init__(self, max_workers=None, min_work_size=1 << 16):
+        """
+        :param max_workers:     The number of threads. Defaults to the number of CPUs.
+        :param min_work_size:   Minimum number of array elements processed by a task.
+        """
+
+        if (max_workers is not None) and (max_workers < 1):
+            raise ValueError('The number of workers must be positive. Got {}.'.format(max_workers))
+        if min_work_size < 1:
+            raise ValueError('The minimum work size must be positive. Got {}.'.format(min_work_size))
+
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.min_work_size = min_work_size
+
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def map(self, function, slots, work_size):
+        """
+        Applies the function to every slot of a level.
+
+        :param function:    A callable slot -> result. It must only read the results of lower levels.
+        :param slots:       The slots of the level.
+        :param work_size:   The estimated number of array elements processed per slot (e.g. the batch length).
+        :return:            The list of results, in slot order.
+        """
+
+        tasks = self.partition(slots, work_size)
+        if len(tasks) <= 1:
+            return [function(slot) for slot in slots]
+
+        futures = [self.pool().submit(_apply, function, task) for task in tasks]
+
+        results = []
+        for future in futures:
+            results.extend(future.result())
+
+        return results
+
+    def partition(self, slots, work_size):
+        """
+        :param slots:       The slots of a level.
+        :param work_size:   The estimated number of array elements processed per slot.
+        :return:            The slots split into consecutive tasks.
+        """
+
+        slots_per_task = max(1, -(-self.min_work_size // max(1, work_size)), -(-len(slots) // self.max_workers))
+        return [slots[i:i + slots_per_task] for i in range(0, len(slots), slots_per_task)]
+
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='autodiff-level')
+            return self._pool
+
+    def shutdown(self):
+        """
+        Waits for the running tasks and stops the threads of the pool.
+        """
+
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        del state['_pool_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+
+
+def _apply(function, slots):
+    return [function(slot) for slot in slots]
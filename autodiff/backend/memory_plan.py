@@ -0,0 +1,84 @@
+import numpy as np
+
+
+# Ops whose values are handed in (feeds, variables, constants) rather than computed, i.e. that own no buffer.
+_INPUT_OPS = {'constant', 'variable', 'feeder'}
+
+
+class MemoryPlan:
+    """
+    Assignment of the op slots of an execution plan to a small set of reusable buffers, based on liveness: a slot
+    takes a free buffer when its instruction runs and gives it back once its last consumer has run. Buffers are taken
+    before the inputs of the instruction are released, s.t. an op never writes over one of its own inputs.
+
+    The number of buffers is the maximum number of op values alive at once (i.e. the width of the graph), instead of
+    the number of nodes.
+    """
+
+    def __init__(self, plan):
+        """
+        :param plan:    The execution plan.
+        """
+
+        self.plan = plan
+        self.buffers = [None] * len(plan)
+
+        free_buffers = []
+        self.n_buffers = 0
+        for slot, (op, _, _) in enumerate(plan.instructions):
+            if op not in _INPUT_OPS:
+                if len(free_buffers) > 0:
+                    self.buffers[slot] = free_buffers.pop()
+                else:
+                    self.buffers[slot] = self.n_buffers
+                    self.n_buffers += 1
+
+            for dead_slot in plan.frees[slot]:
+                if self.buffers[dead_slot] is not None:
+                    free_buffers.append(self.buffers[dead_slot])
+
+
+class BufferPool:
+    """
+    Preallocated arrays backing the buffers of a memory plan. Arrays are allocated the first time a (buffer, part,
+    shape) is requested and reused afterwards, s.t. repeated sweeps over batches of the same length run in a fixed
+    working set. A single scratch array per shape holds the temporaries of an op.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+        self.allocations = 0
+
+    def get(self, key, shape):
+        """
+        :param key:     The buffer key, e.g. (buffer id, part name).
+        :param shape:   The shape of the array.
+        :return:        The array of the buffer for the shape.
+        """
+
+        array = self.arrays.get((key, shape))
+        if array is None:
+            array = np.empty(shape)
+            self.arrays[(key, shape)] = array
+            self.allocations += 1
+
+        return array
+
+    def buffer(self, buffer_id):
+        """
+        :param buffer_id:   Id of a buffer of the memory plan.
+        :return:            A callable (part, shape) -> array handing out the arrays of the buffer. The <scratch> part
+                            is shared by all the buffers.
+        """
+
+        def get_part(part, shape):
+            key = ('scratch',) if part == 'scratch' else (buffer_id, part)
+            return self.get(key, shape)
+
+        return get_part
+
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def clear(self):
+        self.arrays = {}
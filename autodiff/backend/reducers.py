@@ -0,0 +1,154 @@
+import numpy as np
+
+
+def make_reducer(reduce_strategy):
+    """
+    Selects the function used to process a set of per-sample gradients.
+
+    :param reduce_strategy:  Supports <avg>, <median>, <None> - returns the gradients as an array.
+    :return:                 A function mapping a list/array of gradients to the reduced gradient. Gradients of
+                             tensor variables are reduced element-wise, along the sample axis (the first one).
+    """
+
+    if reduce_strategy == 'avg':
+        def _mean(x): return np.mean(x, axis=0)
+        return _mean
+    elif reduce_strategy == 'median':
+        def _median(x): return np.median(x, axis=0)
+        return _median
+    elif reduce_strategy is None:
+        def _nop(x): return np.array(x)
+        return _nop
+    else:
+        raise NotImplementedError('Reduce strategy {} is not implemented.'.format(reduce_strategy))
+
+
+def make_streaming_reducer(reduce_strategy):
+    """
+    Selects the online counterpart of a reduce strategy, used to reduce gradients computed chunk by chunk.
+
+    :param reduce_strategy:  Supports <avg>, <median> (approximated), <None> - collects the gradients in an array.
+    :return:                 A streaming reducer, exposing update(values) and result().
+    """
+
+    if reduce_strategy == 'avg':
+        return StreamingMean()
+    elif reduce_strategy == 'median':
+        return StreamingQuantile(0.5)
+    elif reduce_strategy is None:
+        return StreamingCollector()
+    else:
+        raise NotImplementedError('Reduce strategy {} is not implemented.'.format(reduce_strategy))
+
+
+def batch_length(feeder_batch):
+    """
+    :param feeder_batch:  A dict of feeder id - list of values.
+    :return:              The number of samples in the batch: the minimum of the feed lists represents the entire
+                          feed dict.
+    """
+
+    return min([len(vals) for vals in feeder_batch.values()])
+
+
+class StreamingMean:
+    """
+    Running mean, in O(1) memory.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self.count += values.size
+        self.total += values.sum()
+
+    def result(self):
+        return self.total / self.count
+
+
+class StreamingCollector:
+    """
+    Keeps every value. Used when no reduction is requested.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def update(self, values):
+        self.chunks.append(np.array(values, dtype=float).ravel())
+
+    def result(self):
+        return np.concatenate(self.chunks)
+
+
+class StreamingQuantile:
+    """
+    Approximate quantile of a stream, in O(1) memory, using the P-square algorithm (Jain & Chlamtac, 1985): five
+    markers track the minimum, the quantile, the maximum and two intermediate quantiles, and their heights are adjusted
+    with a piecewise-parabolic interpolation as values arrive. The first five values are kept exactly.
+    """
+
+    def __init__(self, quantile):
+        self.quantile = quantile
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def update(self, values):
+        for value in np.asarray(values, dtype=float).ravel().tolist():
+            self._add(value)
+
+    def _add(self, value):
+        heights = self.heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find the cell of the value, extending the extreme markers if needed.
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust the heights of the middle markers.
+        for i in range(1, 4):
+            offset = self.desired[i] - self.positions[i]
+            if ((offset >= 1) and (self.positions[i + 1] - self.positions[i] > 1)) or \
+                    ((offset <= -1) and (self.positions[i - 1] - self.positions[i] < -1)):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not (heights[i - 1] < height < heights[i + 1]):
+                    height = self._linear(i, step)
+                heights[i] = height
+                self.positions[i] += step
+
+    def _parabolic(self, i, step):
+        h, n = self.heights, self.positions
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i, step):
+        h, n = self.heights, self.positions
+        return h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+
+    def result(self):
+        if len(self.heights) < 5:
+            return np.quantile(self.heights, self.quantile)
+        return self.heights[2]
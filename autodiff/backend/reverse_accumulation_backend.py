@@ -0,0 +1,416 @@
+import numpy as np
+from autodiff.backend.adjoint_engine import AdjointEngine
+from autodiff.backend.execution_plan import compile_plan
+from autodiff.backend.reducers import batch_length, make_reducer
+
+
+class ReverseAccumulationBackend:
+    """
+        Local backend that implements reverse accumulation (adjoint mode) for gradient computation.
+        The reverse accumulation algorithm implemented:
+
+        values = ForwardPass(graph)             # records the value of every node
+        adjoint(targetNode) = 1
+        For each node n, in reverse topological order:
+            For each input i of n:
+                adjoint(i) += adjoint(n) * d(n)/d(i)
+
+        return {v: adjoint(v) for each variable v}
+
+        The feeders are evaluated as arrays, s.t. one forward pass and one adjoint pass cover the entire batch.
+
+        Nodes may hold tensors (see the matmul, sum and mean ops). Every value carries a trailing batch axis behind its
+        per-sample shape, of the batch length for the values that depend on the feeders and of 1 otherwise.
+
+        With an executor (see LevelExecutor), both passes go through the plan level by level, the independent nodes of
+        each level being evaluated concurrently. In the adjoint pass, the contributions of a level are computed
+        concurrently and accumulated afterwards, in plan order. The backend owns the executor, whose threads are
+        stopped by close (or on leaving a with block over the backend).
+
+        Hessian-vector products are computed forward-over-reverse: the vector is pushed as a tangent through the forward
+        pass and through the adjoint pass, s.t. a product costs a fixed number of passes whatever the number of
+        variables. The tangent passes run sequentially.
+    """
+
+    def __init__(self, executor=None):
+        """
+        :param executor:    If set, the LevelExecutor evaluating the levels of the plans concurrently.
+        """
+
+        self.executor = executor
+        self.engine = None
+        self._compiled_graph = None
+        self._plans = {}
+        self.name = 'reverse-acc'
+        self.supports_tensors = True
+
+    def init_capabilities(self, ops_set):
+        self.engine = AdjointEngine(ops_set)
+
+    def close(self):
+        """
+        Shuts down the thread pool of the executor, if any. The backend owns the executor it was given, and the caller
+        owns the backend (registering it into a section does not transfer it), s.t. the caller closes the backend, or
+        uses it in a with block, once done with it.
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def compile(self, graph, target_node_id=None):
+        """
+        Compiles the graph into an execution plan. The plans of the last compiled graph are kept, s.t. repeated passes
+        over the same graph object reuse them.
+
+        :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:  If set, the plan is pruned to the nodes the target depends on.
+        :return:                The execution plan of the graph.
+        """
+
+        if self._compiled_graph is not graph:
+            self._compiled_graph = graph
+            self._plans = {}
+
+        if target_node_id not in self._plans:
+            self._plans[target_node_id] = compile_plan(graph, target_node_id)
+
+        return self._plans[target_node_id]
+
+    def values(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict):
+        """
+        Computes the values for the specified node using a single forward pass.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the value.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :return:                    A list of values for all input values (arrays for tensor nodes).
+        """
+
+        n = batch_length(feed_dict)
+        plan = self.compile(graph, target_node_id)
+        slot_values = self.forward_pass(plan, constant_feed_dict, variable_feed_dict, feed_dict)
+
+        return _per_sample(slot_values[plan.slots[target_node_id]], n)
+
+    def gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, reduce_strategy):
+        """
+        Computes the gradients for the variable nodes using one forward pass and one adjoint pass.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the derivative.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing a set of gradients.
+                                    Supports <avg>, <median>, <None> - returns list of gradients.
+        :return:                    A map that connects variable ids to
+                                    a gradient or list of gradients (if reduce strategy is set to None).
+        """
+
+        _, variable_gradient_map = self.value_and_gradients(graph, target_node_id, feed_dict, variable_feed_dict,
+                                                            constant_feed_dict, reduce_strategy)
+
+        return variable_gradient_map
+
+    def value_and_gradients(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict,
+                            reduce_strategy):
+        """
+        Computes both the values of the target node and the gradients for the variable nodes. The values are the ones
+        recorded by the forward pass of the gradient computation.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node for which to compute the value and the derivative.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param reduce_strategy:     Method of processing a set of gradients.
+                                    Supports <avg>, <median>, <None> - returns list of gradients.
+        :return:                    A tuple (list of values for all input values, map of variable ids to gradients).
+        """
+
+        reducer = make_reducer(reduce_strategy)
+
+        n = batch_length(feed_dict)
+        plan = self.compile(graph, target_node_id)
+        slot_values = self.forward_pass(plan, constant_feed_dict, variable_feed_dict, feed_dict)
+        slot_adjoints = self.adjoint_pass(plan, plan.slots[target_node_id], slot_values, n)
+
+        variable_gradient_map = {}
+        for variable_id, variable_value in variable_feed_dict.items():
+            # Variables that do not influence the target are not in the plan and have a null adjoint.
+            adjoint = slot_adjoints[plan.slots[variable_id]] if variable_id in plan else None
+            target_gradients = np.broadcast_to(0.0 if adjoint is None else adjoint, np.shape(variable_value) + (n,))
+            variable_gradient_map[variable_id] = reducer(np.moveaxis(target_gradients, -1, 0))
+
+        target_values = _per_sample(slot_values[plan.slots[target_node_id]], n)
+
+        return target_values, variable_gradient_map
+
+    def hessian_vector_product(self, graph, target_node_id, feed_dict, variable_feed_dict, constant_feed_dict, vector,
+                               reduce_strategy='avg'):
+        """
+        Computes the product of the Hessian of the target w.r.t. the variables with a vector, without forming the
+        Hessian (forward-over-reverse): the tangents of the variable adjoints, along the vector, are the product.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param target_node_id:      Node being differentiated.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :param vector:              Dict mapping variable ids to the entries of the vector (missing entries are 0).
+        :param reduce_strategy:     Method of processing the per-sample products.
+                                    Supports <avg>, <median>, <None> - returns list of products.
+        :return:                    A map that connects variable ids to their entry of the product.
+        """
+
+        reducer = make_reducer(reduce_strategy)
+
+        n = batch_length(feed_dict)
+        plan = self.compile(graph, target_node_id)
+        target_slot = plan.slots[target_node_id]
+
+        # Every variable is seeded, s.t. the nodes without a tangent are exactly the ones no variable leads to.
+        variable_tangents = {variable_id: vector[variable_id] if variable_id in vector else np.zeros(np.shape(value))
+                             for variable_id, value in variable_feed_dict.items()}
+
+        slot_values = self.forward_pass(plan, constant_feed_dict, variable_feed_dict, feed_dict)
+        slot_tangents = self.tangent_pass(plan, slot_values, variable_tangents)
+        slot_adjoints = self.adjoint_pass(plan, target_slot, slot_values, n)
+        slot_adjoint_tangents = self.adjoint_tangent_pass(plan, target_slot, slot_values, slot_tangents, slot_adjoints)
+
+        variable_product_map = {}
+        for variable_id, variable_value in variable_feed_dict.items():
+            # Variables that do not influence the target have a null row in the Hessian.
+            tangent = slot_adjoint_tangents[plan.slots[variable_id]] if variable_id in plan else None
+            target_products = np.broadcast_to(0.0 if tangent is None else tangent, np.shape(variable_value) + (n,))
+            variable_product_map[variable_id] = reducer(np.moveaxis(target_products, -1, 0))
+
+        return variable_product_map
+
+    def jacobian(self, graph, output_ids, input_ids, feed_dict, variable_feed_dict, constant_feed_dict):
+        """
+        Computes the per-sample Jacobian of several output nodes w.r.t. several input nodes (variables or feeders) in
+        reverse mode: a single forward pass over the nodes the outputs depend on, then one adjoint pass per output,
+        yielding the row of that output for all the inputs at once.
+
+        :param graph:               Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+        :param output_ids:          The ids of the nodes being differentiated.
+        :param input_ids:           The ids of the variable/feeder nodes to differentiate with respect to.
+        :param feed_dict:           Dict mapping node ids to a list of input values.
+        :param variable_feed_dict:  Dict mapping variable ids to their current values.
+        :param constant_feed_dict:  Dict mapping constant ids to their constant values.
+        :return:                    An array of shape (outputs, inputs, batch length).
+        """
+
+        n = batch_length(feed_dict) if len(feed_dict) > 0 else 1
+        plan = self.compile(graph, tuple(output_ids))
+        slot_values = self.forward_pass(plan, constant_feed_dict, variable_feed_dict, feed_dict, n)
+
+        jacobian = np.zeros((len(output_ids), len(input_ids), n))
+        for i, output_id in enumerate(output_ids):
+            slot_adjoints = self.adjoint_pass(plan, plan.slots[output_id], slot_values, n)
+            for j, input_id in enumerate(input_ids):
+                # Inputs the output does not depend on have a null adjoint.
+                adjoint = slot_adjoints[plan.slots[input_id]] if input_id in plan else None
+                if adjoint is None:
+                    continue
+                if np.ndim(adjoint) > 1:
+                    raise ValueError('The Jacobian is computed w.r.t. scalar nodes. Got a tensor node: {}.'
+                                     .format(input_id))
+                jacobian[i, j] = np.broadcast_to(adjoint, (n,))
+
+        return jacobian
+
+    def forward_pass(self, plan, constant_feed, variable_feed, feeder_batch, n=None):
+        """
+        Evaluates every node of the computation graph once, for the entire batch of feeder values.
+
+        :param plan:                    The execution plan of the computation graph.
+        :param constant_feed:           A dict mapping constant ids to their constant value.
+        :param variable_feed:           A dict mapping variable ids to their current value.
+        :param feeder_batch:            A dict mapping feeder ids to a list of their input values.
+        :param n:                       The batch length. By default, the length of the shortest feeder list.
+        :return:                        A list holding the value of every plan slot, with a trailing batch axis.
+        """
+
+        if n is None:
+            n = batch_length(feeder_batch)
+
+        slot_values = [None] * len(plan)
+
+        def evaluate(slot):
+            op, node_id, input_slots = plan.instructions[slot]
+            if op == 'feeder':
+                return np.moveaxis(np.asarray(feeder_batch[node_id][:n], dtype=float), 0, -1)
+            elif op == 'constant':
+                return np.asarray(constant_feed[node_id], dtype=float)[..., None]
+            elif op == 'variable':
+                return np.asarray(variable_feed[node_id], dtype=float)[..., None]
+            return self.engine.forward(op, *[slot_values[input_slot] for input_slot in input_slots])
+
+        if self.executor is None:
+            for slot in range(len(plan)):
+                slot_values[slot] = evaluate(slot)
+        else:
+            levels = plan.levels()
+            for level_index, level in enumerate(levels):
+                # The input level only wraps the feeds.
+                results = self.executor.map(evaluate, level, n) if level_index > 0 else map(evaluate, level)
+                for slot, value in zip(level, results):
+                    slot_values[slot] = value
+
+        return slot_values
+
+    def adjoint_pass(self, plan, target_slot, slot_values, n):
+        """
+        Propagates the adjoint of the target node back to every node that influences it.
+
+        :param plan:                    The execution plan of the computation graph.
+        :param target_slot:             The plan slot of the node being differentiated.
+        :param slot_values:             The slot values recorded by the forward pass.
+        :param n:                       The batch length.
+        :return:                        A list holding the per-sample adjoints of every plan slot
+                                        (None for the nodes that do not influence the target).
+        """
+
+        if np.ndim(slot_values[target_slot]) > 1:
+            raise ValueError('Only scalar nodes can be differentiated. Got a value of shape {}.'
+                             .format(np.shape(slot_values[target_slot])[:-1]))
+
+        slot_adjoints = [None] * len(plan)
+        slot_adjoints[target_slot] = np.ones(n)
+
+        def contributions(slot):
+            op, _, input_slots = plan.instructions[slot]
+            input_adjoints = self.engine.adjoint(op, slot_adjoints[slot], slot_values[slot],
+                                                 *[slot_values[input_slot] for input_slot in input_slots])
+            return [_unbroadcast(input_adjoint, slot_values[input_slot])
+                    for input_slot, input_adjoint in zip(input_slots, input_adjoints)]
+
+        def accumulate(slot, input_adjoints):
+            for input_slot, input_adjoint in zip(plan.instructions[slot][2], input_adjoints):
+                if slot_adjoints[input_slot] is None:
+                    slot_adjoints[input_slot] = input_adjoint
+                else:
+                    slot_adjoints[input_slot] = slot_adjoints[input_slot] + input_adjoint
+
+        if self.executor is None:
+            # Nodes after the target in the plan cannot influence it.
+            for slot in range(target_slot, -1, -1):
+                if (slot_adjoints[slot] is not None) and (len(plan.instructions[slot][2]) > 0):
+                    accumulate(slot, contributions(slot))
+        else:
+            # The consumers of a node sit on higher levels, s.t. its adjoint is complete when its level is reached.
+            for level in reversed(plan.levels()[1:]):
+                slots = [slot for slot in reversed(level)
+                         if (slot <= target_slot) and (slot_adjoints[slot] is not None)]
+                for slot, input_adjoints in zip(slots, self.executor.map(contributions, slots, n)):
+                    accumulate(slot, input_adjoints)
+
+        return slot_adjoints
+
+
+    def tangent_pass(self, plan, slot_values, variable_tangents):
+        """
+        Propagates the tangents of the variables along the values recorded by the forward pass.
+
+        :param plan:                    The execution plan of the computation graph.
+        :param slot_values:             The slot values recorded by the forward pass.
+        :param variable_tangents:       A dict mapping variable ids to their tangent (missing variables have none).
+        :return:                        A list holding the tangent of every plan slot
+                                        (None for the nodes that do not depend on the seeded variables).
+        """
+
+        slot_tangents = [None] * len(plan)
+        for slot in range(len(plan)):
+            op, node_id, input_slots = plan.instructions[slot]
+            if op == 'variable':
+                if node_id in variable_tangents:
+                    slot_tangents[slot] = np.asarray(variable_tangents[node_id], dtype=float)[..., None]
+                continue
+
+            input_tangents = [slot_tangents[input_slot] for input_slot in input_slots]
+            if any(tangent is not None for tangent in input_tangents):
+                slot_tangents[slot] = self.engine.tangent(op, slot_values[slot],
+                                                          [slot_values[input_slot] for input_slot in input_slots],
+                                                          input_tangents)
+
+        return slot_tangents
+
+    def adjoint_tangent_pass(self, plan, target_slot, slot_values, slot_tangents, slot_adjoints):
+        """
+        Propagates the tangents of the adjoints back to every node that influences the target, i.e. differentiates the
+        adjoint pass along the tangents of the tangent pass.
+
+        :param plan:                    The execution plan of the computation graph.
+        :param target_slot:             The plan slot of the node being differentiated.
+        :param slot_values:             The slot values recorded by the forward pass.
+        :param slot_tangents:           The slot tangents computed by the tangent pass.
+        :param slot_adjoints:           The slot adjoints computed by the adjoint pass.
+        :return:                        A list holding the per-sample adjoint tangents of every plan slot
+                                        (None when null).
+        """
+
+        # The adjoint of the target is constant.
+        slot_adjoint_tangents = [None] * len(plan)
+
+        for slot in range(target_slot, -1, -1):
+            op, _, input_slots = plan.instructions[slot]
+            if (slot_adjoints[slot] is None) or (len(input_slots) == 0):
+                continue
+
+            input_tangents = [slot_tangents[input_slot] for input_slot in input_slots]
+            if (slot_adjoint_tangents[slot] is None) and all(tangent is None for tangent in input_tangents):
+                continue
+
+            contributions = self.engine.adjoint_tangent(op, slot_adjoints[slot], slot_adjoint_tangents[slot],
+                                                        slot_values[slot], slot_tangents[slot],
+                                                        [slot_values[input_slot] for input_slot in input_slots],
+                                                        input_tangents)
+            for input_slot, contribution in zip(input_slots, contributions):
+                # Inputs without a tangent lead to no variable.
+                if (contribution is None) or (slot_tangents[input_slot] is None):
+                    continue
+                contribution = _unbroadcast(contribution, slot_values[input_slot])
+                if slot_adjoint_tangents[input_slot] is None:
+                    slot_adjoint_tangents[input_slot] = contribution
+                else:
+                    slot_adjoint_tangents[input_slot] = slot_adjoint_tangents[input_slot] + contribution
+
+        return slot_adjoint_tangents
+
+
+def _per_sample(value, n):
+    # Splits a value along its batch axis: a list of floats for scalar nodes, of arrays for tensor nodes.
+    value = np.broadcast_to(value, np.shape(value)[:-1] + (n,))
+    if value.ndim == 1:
+        return value.tolist()
+    return list(np.moveaxis(value, -1, 0).copy())
+
+
+def _unbroadcast(adjoint, value):
+    """
+    Sums the adjoint of an input over the per-sample axes the input was broadcast along, keeping the batch axis s.t.
+    the adjoints remain per sample.
+    """
+
+    shape = np.shape(value)[:-1]
+    adjoint_shape = np.shape(adjoint)[:-1]
+    if adjoint_shape == shape:
+        return adjoint
+
+    adjoint = np.sum(adjoint, axis=tuple(range(len(adjoint_shape) - len(shape))))
+    axes = tuple(i for i, size in enumerate(shape) if (size == 1) and (adjoint.shape[i] != 1))
+    if len(axes) > 0:
+        adjoint = np.sum(adjoint, axis=axes, keepdims=True)
+
+    return adjoint
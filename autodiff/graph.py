@@ -59,6 +59,7 @@ class GraphAdjacencyList(Graph):
     def nodes(self):
         return self._outgoing.keys()
 
+
 class GraphAdjacencyMatrix(Graph):
     """
     Graph implemented using an adjacency matrix.
@@ -68,22 +69,25 @@ class GraphAdjacencyMatrix(Graph):
         super().__init__()
         self._n = 0
         self._resize_amount = resize_amount
-        self._adj = np.zeros(shape=(resize_amount, resize_amount), dtype=np.int)
+        self._adj = np.zeros(shape=(resize_amount, resize_amount), dtype=int)
         self._id_index_map = {}
+        self._index_ids = []
 
     def _resize(self):
-        self._adj = np.append(self._adj, [0] * self._resize_amount, 0)
-        self._adj = np.append(self._adj, [[0]] * self._resize_amount, 1)
+        # Grow geometrically, s.t. the matrix is copied O(log n) times.
+        size = max(2 * self._adj.shape[0], self._adj.shape[0] + self._resize_amount)
+        adj = np.zeros(shape=(size, size), dtype=int)
+        adj[:self._n, :self._n] = self._adj[:self._n, :self._n]
+        self._adj = adj
 
     def add_node(self, node_identifier):
-        # Add first, resize later.
-        self._n += 1
-
         if self._adj.shape[0] <= self._n:
             self._resize()
 
         # Register the new index
         self._id_index_map[node_identifier] = self._n
+        self._index_ids.append(node_identifier)
+        self._n += 1
 
     def add_edge(self, a, b, value):
         a_ix = self._id_index_map[a]
@@ -102,7 +106,7 @@ class GraphAdjacencyMatrix(Graph):
         ix = self._id_index_map[node_identifier]
 
         nodes = self._adj[ix, :self._n].tolist()
-        return [(i, nodes[i]) for i in range(len(nodes)) if nodes[i] != 0]
+        return [(self._index_ids[i], nodes[i]) for i in range(len(nodes)) if nodes[i] != 0]
 
     def incoming(self, node_identifier):
         """
@@ -114,4 +118,227 @@ class GraphAdjacencyMatrix(Graph):
 
         ix = self._id_index_map[node_identifier]
         nodes = self._adj[:self._n, ix].tolist()
-        return [(i, nodes[i]) for i in range(len(nodes)) if nodes[i] != 0]
+        return [(self._index_ids[i], nodes[i]) for i in range(len(nodes)) if nodes[i] != 0]
+
+    def nodes(self):
+        return self._id_index_map.keys()
+
+
+class GraphCSR(Graph):
+    """
+    Graph implemented using compressed sparse arrays. Edges are appended to int32 edge buffers (grown geometrically)
+    and, on the first query after a change, sorted into a CSR (outgoing) and a CSC (incoming) representation.
+    Edges keep their insertion order within each row/column, s.t. the inputs of a node keep their operand order.
+
+    Node identifiers must be non-negative integers (i.e. the ids handed out by the active section).
+    """
+
+    def __init__(self, initial_capacity=64):
+        super().__init__()
+        self._n = 0
+        self._m = 0
+
+        # Node id <-> dense index maps.
+        self._index_ids = np.zeros(initial_capacity, dtype=np.int64)
+        self._id_index_map = np.full(initial_capacity, -1, dtype=np.int32)
+
+        # Edge buffers, in insertion order.
+        self._edge_src = np.zeros(initial_capacity, dtype=np.int32)
+        self._edge_dst = np.zeros(initial_capacity, dtype=np.int32)
+        self._edge_val = np.zeros(initial_capacity, dtype=np.int32)
+
+        # Compressed representations, rebuilt lazily.
+        self._dirty = True
+        self._out_indptr = None
+        self._out_indices = None
+        self._out_values = None
+        self._in_indptr = None
+        self._in_indices = None
+        self._in_values = None
+
+    def add_node(self, node_identifier):
+        if node_identifier >= len(self._id_index_map):
+            self._id_index_map = _grow(self._id_index_map, node_identifier + 1, fill=-1)
+        if self._n >= len(self._index_ids):
+            self._index_ids = _grow(self._index_ids, self._n + 1)
+
+        self._id_index_map[node_identifier] = self._n
+        self._index_ids[self._n] = node_identifier
+        self._n += 1
+        self._dirty = True
+
+    def add_edge(self, a, b, value):
+        if self._m >= len(self._edge_src):
+            self._edge_src = _grow(self._edge_src, self._m + 1)
+            self._edge_dst = _grow(self._edge_dst, self._m + 1)
+            self._edge_val = _grow(self._edge_val, self._m + 1)
+
+        self._edge_src[self._m] = self._id_index_map[a]
+        self._edge_dst[self._m] = self._id_index_map[b]
+        self._edge_val[self._m] = value
+        self._m += 1
+        self._dirty = True
+
+    def _build(self):
+        if not self._dirty:
+            return
+
+        src = self._edge_src[:self._m]
+        dst = self._edge_dst[:self._m]
+        val = self._edge_val[:self._m]
+
+        # Stable sorts keep the insertion order of the edges within a row/column.
+        out_order = np.argsort(src, kind='stable')
+        self._out_indptr = _indptr(src, self._n)
+        self._out_indices = self._index_ids[dst[out_order]]
+        self._out_values = val[out_order]
+
+        in_order = np.argsort(dst, kind='stable')
+        self._in_indptr = _indptr(dst, self._n)
+        self._in_indices = self._index_ids[src[in_order]]
+        self._in_values = val[in_order]
+
+        self._dirty = False
+
+    def outgoing_ids(self, node_identifier):
+        """
+        Collects the ids of the nodes to which the specified node connects.
+
+        :param node_identifier:  Id of the node.
+        :return:                 An array view holding the node ids.
+        """
+
+        self._build()
+        ix = self._id_index_map[node_identifier]
+        return self._out_indices[self._out_indptr[ix]:self._out_indptr[ix + 1]]
+
+    def incoming_ids(self, node_identifier):
+        """
+        Collects the ids of the nodes that connect to the specified node, in insertion order.
+
+        :param node_identifier:  Id of the node.
+        :return:                 An array view holding the node ids.
+        """
+
+        self._build()
+        ix = self._id_index_map[node_identifier]
+        return self._in_indices[self._in_indptr[ix]:self._in_indptr[ix + 1]]
+
+    def outgoing(self, node_identifier):
+        """
+        Collects the nodes to which the specified node connects.
+
+        :param node_identifier:  Id of the node.
+        :return:                 A list of tuples (id, value) representing the outgoing edge values.
+        """
+
+        self._build()
+        ix = self._id_index_map[node_identifier]
+        start, end = self._out_indptr[ix], self._out_indptr[ix + 1]
+        return list(zip(self._out_indices[start:end].tolist(), self._out_values[start:end].tolist()))
+
+    def incoming(self, node_identifier):
+        """
+        Collects the nodes that connect to the specified node.
+
+        :param node_identifier:  Id of the node.
+        :return:                 A list of tuples (id, value) representing the incoming edge values.
+        """
+
+        self._build()
+        ix = self._id_index_map[node_identifier]
+        start, end = self._in_indptr[ix], self._in_indptr[ix + 1]
+        return list(zip(self._in_indices[start:end].tolist(), self._in_values[start:end].tolist()))
+
+    def outgoing_arrays(self):
+        """
+        Bulk view of the outgoing edges, in CSR form: the outgoing edges of the node at dense index i are
+        indices[indptr[i]:indptr[i + 1]] (node ids) and values[indptr[i]:indptr[i + 1]].
+
+        :return:    A tuple (indptr, indices, values).
+        """
+
+        self._build()
+        return self._out_indptr, self._out_indices, self._out_values
+
+    def incoming_arrays(self):
+        """
+        Bulk view of the incoming edges, in CSC form: the incoming edges of the node at dense index i are
+        indices[indptr[i]:indptr[i + 1]] (node ids) and values[indptr[i]:indptr[i + 1]].
+
+        :return:    A tuple (indptr, indices, values).
+        """
+
+        self._build()
+        return self._in_indptr, self._in_indices, self._in_values
+
+    def index_of(self, node_identifier):
+        """
+        :param node_identifier:  Id of the node.
+        :return:                 The dense index of the node (i.e. its insertion rank), or -1 if it is not in the graph.
+        """
+
+        if (node_identifier < 0) or (node_identifier >= len(self._id_index_map)):
+            return -1
+        return int(self._id_index_map[node_identifier])
+
+    def node_ids(self):
+        """
+        :return:    An array view holding the node ids, by dense index (i.e. in insertion order).
+        """
+
+        return self._index_ids[:self._n]
+
+    def nodes(self):
+        return self.node_ids().tolist()
+
+    def nbytes(self):
+        """
+        :return:    The memory held by the graph arrays, in bytes.
+        """
+
+        arrays = [self._index_ids, self._id_index_map, self._edge_src, self._edge_dst, self._edge_val]
+        if not self._dirty:
+            arrays += [self._out_indptr, self._out_indices, self._out_values,
+                       self._in_indptr, self._in_indices, self._in_values]
+        return sum(array.nbytes for array in arrays)
+
+
+def _grow(array, min_length, fill=0):
+    # Geometric growth: amortized O(1) appends.
+    grown = np.full(max(2 * len(array), min_length), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _indptr(row_indices, n):
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_indices, minlength=n), out=indptr[1:])
+    return indptr
+
+
+class FlattenedGraph(dict):
+    """
+    Backend-ready form of a graph: a dict mapping node ids to <op name, input ids, output ids>.
+    Besides the nodes, it carries the structural hash of the graph, the set of ops it uses and a dict in which
+    backends can keep the state compiled for it (e.g. execution plans), s.t. the state lives as long as the graph.
+
+    Graphs produced by the optimization passes also carry the constant values they need, the aliases of the nodes
+    they removed (removed node id -> id of the node computing its value) and a report of the node counts.
+    """
+
+    def __init__(self, nodes, graph_hash=None, ops=None, constants=None, aliases=None, report=None):
+        super().__init__(nodes)
+        self.graph_hash = graph_hash
+        self.ops = ops if ops is not None else {node['op'] for node in nodes.values()}
+        self.constants = constants
+        self.aliases = aliases if aliases is not None else {}
+        self.report = report
+        self.compiled = {}
+
+    def resolve(self, node_id):
+        """
+        Maps a node id of the original graph to the id of the node computing its value in this graph.
+        """
+
+        return self.aliases.get(node_id, node_id)
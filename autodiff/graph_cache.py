@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class GraphCache:
+    """
+    Bounded LRU cache of flattened graphs (and the backend state compiled for them), keyed by a structural graph hash.
+
+    An entry can be stored along with the structure of its graph (see GraphStructure), which is then compared on every
+    lookup, s.t. a hash collision between two graphs is a miss instead of handing out the graph of another model.
+    """
+
+    def __init__(self, capacity=16):
+        if capacity < 1:
+            raise ValueError('The cache capacity must be positive. Got {}.'.format(capacity))
+
+        self.capacity = capacity
+        self._entries = OrderedDict()
+
+        # Counters, used to size the cache.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collisions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, structure=None):
+        """
+        Looks up an entry and marks it as the most recently used one.
+
+        :param key:         The graph hash.
+        :param structure:   If set, the structure the entry must have been stored with.
+        :return:            The cached entry or None on a miss.
+        """
+
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        entry_structure, entry = self._entries[key]
+        if (structure is not None) and (entry_structure != structure):
+            self.misses += 1
+            self.collisions += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry, structure=None):
+        """
+        Stores an entry, evicting the least recently used ones while the cache is over capacity.
+
+        :param key:         The graph hash.
+        :param entry:       The value to cache.
+        :param structure:   The structure of the graph, compared on lookups.
+        """
+
+        self._entries[key] = (structure, entry)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries = OrderedDict()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'collisions': self.collisions
+        }
+
+
+class GraphStructure:
+    """
+    Compact snapshot of a graph structure, compared on graph cache hits: the node ids, the incoming edges in CSC form
+    (see GraphCSR.incoming_arrays), the op name and shape of every node and the constant values.
+    """
+
+    __slots__ = ('node_ids', 'in_indptr', 'in_indices', 'ops', 'shapes', 'constants')
+
+    def __init__(self, node_ids, in_indptr, in_indices, ops, shapes, constants):
+        self.node_ids = node_ids
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+        self.ops = ops
+        self.shapes = shapes
+        self.constants = constants
+
+    def __eq__(self, other):
+        if not isinstance(other, GraphStructure):
+            return NotImplemented
+
+        if (self.ops != other.ops) or (self.shapes != other.shapes):
+            return False
+        if self.constants.keys() != other.constants.keys():
+            return False
+        if not (np.array_equal(self.node_ids, other.node_ids) and np.array_equal(self.in_indptr, other.in_indptr)
+                and np.array_equal(self.in_indices, other.in_indices)):
+            return False
+
+        return all((value is other.constants[node_id]) or (value_key(value) == value_key(other.constants[node_id]))
+                   for node_id, value in self.constants.items())
+
+    __hash__ = None
+
+
+def value_key(value):
+    """
+    Builds a hashable key identifying a constant value, used to hash and compare constants.
+
+    :param value:   The constant value (scalar or array).
+    :return:        The value itself if it is hashable, a (type, shape, bytes) tuple for arrays, its repr otherwise.
+    """
+
+    if isinstance(value, np.ndarray):
+        return type(value).__name__, value.dtype.str, value.shape, value.tobytes()
+
+    try:
+        hash(value)
+        return type(value).__name__, value
+    except TypeError:
+        return type(value).__name__, repr(value)
@@ -2,6 +2,8 @@ from autodiff.active_section import active_section
 
 
 class GraphNode:
+    __slots__ = ('op_id', 'incoming', 'extra_info', 'identifier', 'section')
+
     def __init__(self, op_id, incoming, extra_info=None):
         self.op_id = op_id
         self.incoming = incoming
@@ -29,6 +31,15 @@ class GraphNode:
     def __truediv__(self, other):
         return self._handle_two_input_op(other, 'div')
 
+    def __pow__(self, other):
+        return self._handle_two_input_op(other, 'pow')
+
+    def __matmul__(self, other):
+        return self._handle_two_input_op(other, 'matmul')
+
+    def __abs__(self):
+        return GraphNode('abs', [self])
+
     # TODO: more ops!!
 
 
@@ -40,9 +51,106 @@ def variable(init_value):
     return GraphNode('variable', [], extra_info=init_value)
 
 
-def feeder():
-    return GraphNode('feeder', [])
+def feeder(shape=()):
+    """
+    :param shape:   The shape of the value fed per sample. e.g. (features,) for a feature vector.
+    """
+
+    return GraphNode('feeder', [], extra_info=tuple(shape))
 
 
 def loss(node):
     return GraphNode('loss', [node])
+
+
+def matmul(a, b):
+    return a @ b
+
+
+def reduce_sum(node):
+    return GraphNode('sum', [node])
+
+
+def reduce_mean(node):
+    return GraphNode('mean', [node])
+
+
+def sqrt(node):
+    return GraphNode('sqrt', [node])
+
+
+def exp(node):
+    return GraphNode('exp', [node])
+
+
+def log(node):
+    """
+    Base 10 logarithm (see ln for the natural logarithm).
+    """
+
+    return GraphNode('log', [node])
+
+
+def ln(node):
+    return GraphNode('ln', [node])
+
+
+def sin(node):
+    return GraphNode('sin', [node])
+
+
+def cos(node):
+    return GraphNode('cos', [node])
+
+
+def tan(node):
+    return GraphNode('tan', [node])
+
+
+def tanh(node):
+    return GraphNode('tanh', [node])
+
+
+def arctan(node):
+    return GraphNode('arctan', [node])
+
+
+def logistic(node):
+    return GraphNode('logistic', [node])
+
+
+def erf(node):
+    return GraphNode('erf', [node])
+
+
+def gudermann(node):
+    return GraphNode('gudermann', [node])
+
+
+def softplus(node):
+    return GraphNode('softplus', [node])
+
+
+def rectifier(node):
+    return GraphNode('rectifier', [node])
+
+
+def squared_error(prediction, target):
+    """
+    Fused (prediction - target)^2, evaluated by a single kernel.
+    """
+
+    return GraphNode('squared_error', [_as_node(prediction), _as_node(target)])
+
+
+def logistic_log_loss(logits, labels):
+    """
+    Fused log-loss of logistic(logits) against labels in [0, 1], evaluated by a single kernel that stays finite for
+    saturated logistics.
+    """
+
+    return GraphNode('logistic_log_loss', [_as_node(logits), _as_node(labels)])
+
+
+def _as_node(value):
+    return value if type(value) == GraphNode else constant(value)
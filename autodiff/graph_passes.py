@@ -0,0 +1,210 @@
+import numpy as np
+from autodiff.graph import FlattenedGraph
+from autodiff.graph_cache import value_key
+from autodiff.backend.adjoint_engine import AdjointEngine
+from autodiff.backend.execution_plan import topological_order
+
+
+# Ops whose result does not depend on the order of their inputs.
+_COMMUTATIVE_OPS = {'add', 'mul'}
+
+# Ops that are never folded nor merged.
+_PINNED_OPS = {'constant', 'variable', 'feeder', 'loss'}
+
+# Ops whose kernels expect a trailing batch axis, s.t. they cannot be evaluated over plain constants.
+_BATCHED_OPS = {'matmul', 'sum', 'mean'}
+
+
+def optimize_graph(graph, constants):
+    """
+    Runs the optimization pipeline over a flattened graph: constant folding, constant deduplication, common
+    subexpression elimination and kernel fusion. The input graph is not modified.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param constants:   Dict mapping constant ids to their constant values.
+    :return:            A FlattenedGraph whose <constants> hold the constant values of the optimized graph, whose
+                        <aliases> map the ids of removed nodes to the node now computing their value and whose
+                        <report> holds the node counts.
+    """
+
+    nodes_before = len(graph)
+    graph_hash = getattr(graph, 'graph_hash', None)
+
+    graph, constants, folded = fold_constants(graph, constants)
+    graph, constants, constant_aliases = deduplicate_constants(graph, constants)
+    graph, subexpression_aliases = eliminate_common_subexpressions(graph)
+    graph, fused = fuse_kernels(graph, constants)
+
+    aliases = _compose_aliases(constant_aliases, subexpression_aliases)
+
+    report = {
+        'nodes_before': nodes_before,
+        'nodes_after': len(graph),
+        'folded': len(folded),
+        'deduplicated_constants': len(constant_aliases),
+        'merged_subexpressions': len(subexpression_aliases),
+        'fused': len(fused)
+    }
+
+    return FlattenedGraph(graph, graph_hash=graph_hash, constants=constants, aliases=aliases, report=report)
+
+
+def fold_constants(graph, constants):
+    """
+    Replaces the op nodes whose inputs are all constants by constants holding their value. Constants left without
+    consumers by the folding are kept, since they can still be evaluated on their own (plans pruned to a target skip
+    them).
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param constants:   Dict mapping constant ids to their constant values.
+    :return:            A tuple (graph, constants, ids of the folded nodes).
+    """
+
+    engine = AdjointEngine()
+
+    nodes = {node_id: _copy_node(node) for node_id, node in graph.items()}
+    constants = dict(constants)
+
+    folded = set()
+    for node_id in topological_order(graph):
+        node = nodes[node_id]
+        if (node['op'] in _PINNED_OPS) or (node['op'] in _BATCHED_OPS) or (node['op'] not in engine.ops):
+            continue
+
+        if all(nodes[input_id]['op'] == 'constant' for input_id in node['input_ids']):
+            constants[node_id] = engine.forward(node['op'], *[constants[input_id] for input_id in node['input_ids']])
+            node['op'] = 'constant'
+            node['input_ids'] = []
+            folded.add(node_id)
+
+    return _relink(nodes), constants, folded
+
+
+def deduplicate_constants(graph, constants):
+    """
+    Merges the constants holding identical values into a single constant node.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param constants:   Dict mapping constant ids to their constant values.
+    :return:            A tuple (graph, constants, dict mapping removed constant ids to the kept constant id).
+    """
+
+    aliases = {}
+    kept_constants = {}
+    for node_id in sorted(constants.keys()):
+        key = value_key(constants[node_id])
+        if key in kept_constants:
+            aliases[node_id] = kept_constants[key]
+        else:
+            kept_constants[key] = node_id
+
+    constants = {node_id: value for node_id, value in constants.items() if node_id not in aliases}
+
+    return _apply_aliases(graph, aliases), constants, aliases
+
+
+def eliminate_common_subexpressions(graph):
+    """
+    Merges the op nodes that apply the same op to the same inputs. Inputs of commutative ops are compared unordered.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :return:            A tuple (graph, dict mapping removed node ids to the kept node id).
+    """
+
+    aliases = {}
+    expressions = {}
+    for node_id in topological_order(graph):
+        node = graph[node_id]
+        if node['op'] in _PINNED_OPS:
+            continue
+
+        input_ids = [aliases.get(input_id, input_id) for input_id in node['input_ids']]
+        if node['op'] in _COMMUTATIVE_OPS:
+            input_ids = sorted(input_ids)
+
+        key = (node['op'], tuple(input_ids))
+        if key in expressions:
+            aliases[node_id] = expressions[key]
+        else:
+            expressions[key] = node_id
+
+    return _apply_aliases(graph, aliases), aliases
+
+
+def fuse_kernels(graph, constants):
+    """
+    Rewrites the squares of differences, (a - b) * (a - b) and (a - b) ** 2, into fused squared_error(a, b) nodes, s.t.
+    a single kernel replaces two op nodes and the residual temporary. Runs after the common subexpression elimination,
+    which turns both factors of the product into the same node.
+
+    The difference nodes are kept, s.t. their values can still be requested, but plans that only need the fused node
+    prune them.
+
+    :param graph:       Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>.
+    :param constants:   Dict mapping constant ids to their constant values.
+    :return:            A tuple (graph, dict mapping the fused node ids to the difference node they absorbed).
+    """
+
+    nodes = {node_id: _copy_node(node) for node_id, node in graph.items()}
+
+    fused = {}
+    for node_id, node in nodes.items():
+        input_ids = node['input_ids']
+        if (node['op'] == 'mul') and (len(input_ids) == 2) and (input_ids[0] == input_ids[1]):
+            residual_id = input_ids[0]
+        elif (node['op'] == 'pow') and (nodes[input_ids[1]]['op'] == 'constant') and \
+                (np.ndim(constants[input_ids[1]]) == 0) and (constants[input_ids[1]] == 2):
+            residual_id = input_ids[0]
+        else:
+            continue
+
+        if nodes[residual_id]['op'] != 'sub':
+            continue
+
+        node['op'] = 'squared_error'
+        node['input_ids'] = list(nodes[residual_id]['input_ids'])
+        fused[node_id] = residual_id
+
+    return _relink(nodes), fused
+
+
+def _copy_node(node):
+    # Other node attributes (e.g. the shape) are kept as is.
+    return dict(node, input_ids=list(node['input_ids']), output_ids=list(node['output_ids']))
+
+
+def _relink(nodes):
+    """
+    Recomputes the output ids of every node from the input ids.
+    """
+
+    for node in nodes.values():
+        node['output_ids'] = []
+
+    for node_id, node in nodes.items():
+        for input_id in node['input_ids']:
+            nodes[input_id]['output_ids'].append(node_id)
+
+    return nodes
+
+
+def _apply_aliases(graph, aliases):
+    """
+    Removes the aliased nodes and redirects their consumers to the nodes they are aliased to.
+    """
+
+    nodes = {}
+    for node_id, node in graph.items():
+        if node_id in aliases:
+            continue
+
+        nodes[node_id] = _copy_node(node)
+        nodes[node_id]['input_ids'] = [aliases.get(input_id, input_id) for input_id in node['input_ids']]
+
+    return _relink(nodes)
+
+
+def _compose_aliases(first, second):
+    aliases = {node_id: second.get(alias_id, alias_id) for node_id, alias_id in first.items()}
+    aliases.update(second)
+    return aliases
@@ -0,0 +1,74 @@
+import numpy as np
+
+
+# Ops applied element by element, broadcasting their inputs like NumPy.
+_ELEMENTWISE_OPS = {'add', 'sub', 'mul', 'div', 'pow', 'sqrt', 'logistic', 'loss', 'abs', 'sin', 'cos', 'tan', 'tanh',
+                    'arctan', 'exp', 'log', 'ln', 'erf', 'gudermann', 'softplus', 'rectifier', 'squared_error',
+                    'logistic_log_loss'}
+
+# Ops reducing all the axes of their input to a scalar (per sample).
+_REDUCTION_OPS = {'sum', 'mean'}
+
+
+def infer_shape(op, input_shapes):
+    """
+    Infers the shape of the value of a node, per sample (i.e. without the batch axis), from the shapes of its inputs.
+
+    :param op:              The op of the node.
+    :param input_shapes:    The shapes of the input values, in input order.
+    :return:                The shape of the value, as a tuple.
+    """
+
+    if op in _ELEMENTWISE_OPS:
+        try:
+            return tuple(np.broadcast_shapes(*input_shapes))
+        except ValueError:
+            raise ValueError('Cannot broadcast the inputs of {}: {}.'.format(op, input_shapes))
+
+    if op in _REDUCTION_OPS:
+        return ()
+
+    if op == 'matmul':
+        a, b = input_shapes
+        if (len(a) not in (1, 2)) or (len(b) not in (1, 2)):
+            raise ValueError('matmul supports vectors and matrices. Got {} and {}.'.format(a, b))
+        if a[-1] != b[0]:
+            raise ValueError('Mismatched matmul dimensions: {} and {}.'.format(a, b))
+        return a[:-1] + b[1:]
+
+    raise NotImplementedError('Shape inference is not implemented for {}.'.format(op))
+
+
+def infer_shapes(graph, leaf_shapes):
+    """
+    Infers the per-sample shape of every node of a graph.
+
+    :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids>. The
+                            nodes must be listed in topological order (e.g. registration order).
+    :param leaf_shapes:     Dict mapping the ids of the input nodes (constants, variables, feeders) to their shapes.
+    :return:                Dict mapping node ids to their shapes.
+    """
+
+    shapes = {}
+    for node_id, node in graph.items():
+        if len(node['input_ids']) == 0:
+            shapes[node_id] = tuple(leaf_shapes.get(node_id, ()))
+        else:
+            shapes[node_id] = infer_shape(node['op'], [shapes[input_id] for input_id in node['input_ids']])
+
+    return shapes
+
+
+def check_scalar_graph(graph, backend_name):
+    """
+    Raises a ValueError if some node of the graph holds a tensor value, for the backends that only handle scalars.
+
+    :param graph:           Computation graph. i.e. dict mapping node ids to <op name, input ids, output ids, shape>.
+    :param backend_name:    The name of the backend, for the error message.
+    """
+
+    tensor_ids = [node_id for node_id, node in graph.items() if len(node.get('shape', ())) > 0]
+    if len(tensor_ids) > 0:
+        raise ValueError('The {} backend only supports scalar nodes. Got tensor nodes: {}. Use the reverse '
+                         'accumulation backend (ReverseAccumulationBackend) for tensor graphs.'
+                         .format(backend_name, tensor_ids))
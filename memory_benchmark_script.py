@@ -0,0 +1,117 @@
+import tracemalloc
+
+import numpy as np
+
+from autodiff.graph_nodes import GraphNode, variable, feeder, loss
+from autodiff.active_section import ActiveSection
+from autodiff.backend.dual_number_engine import DualNumber
+from autodiff.backend.forward_accumulation_backend import ForwardAccumulationBackend
+
+
+# Unslotted variants, i.e. the former full __dict__ objects.
+class DictGraphNode(GraphNode):
+    pass
+
+
+class DictDualNumber(DualNumber):
+    pass
+
+
+def measure(f):
+    """
+    Runs f and reports the memory it allocated and kept alive (the result is held until the measurement ends).
+
+    :return:    A tuple (retained bytes, peak bytes).
+    """
+
+    tracemalloc.start()
+    result = f()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak
+
+
+def build_model(n_terms):
+    # Linear model with n_terms features: sum_i x_i * theta_i.
+    xs = [feeder() for _ in range(n_terms)]
+    thetas = [variable(0.0) for _ in range(n_terms)]
+    y = feeder()
+
+    model = xs[0] * thetas[0]
+    for x, theta in zip(xs[1:], thetas[1:]):
+        model = model + (x * theta)
+    return loss((model - y) * (model - y)), xs + [y], thetas
+
+
+def report(name, before, after):
+    print('{:<48} {:>12,} B -> {:>12,} B  ({:.1f}x)'.format(name, before, after, before / max(after, 1)))
+
+
+def main():
+    n_nodes = 100000
+    n_duals = 200000
+    n_terms = 500
+    n_samples = 64
+
+    with ActiveSection():
+        dict_nodes, _ = measure(lambda: [DictGraphNode('constant', [], extra_info=1.0) for _ in range(n_nodes)])
+    with ActiveSection():
+        slot_nodes, _ = measure(lambda: [GraphNode('constant', [], extra_info=1.0) for _ in range(n_nodes)])
+    report('{} graph nodes (incl. registration)'.format(n_nodes), dict_nodes, slot_nodes)
+    print('{:<48} {:>12,.0f} B -> {:>12,.0f} B'.format('  per node', dict_nodes / n_nodes, slot_nodes / n_nodes))
+
+    dict_duals, _ = measure(lambda: [DictDualNumber(1.0, 0.0) for _ in range(n_duals)])
+    slot_duals, _ = measure(lambda: [DualNumber(1.0, 0.0) for _ in range(n_duals)])
+    report('{} dual numbers'.format(n_duals), dict_duals, slot_duals)
+
+    with ActiveSection() as section:
+        loss_node, feeders, thetas = build_model(n_terms)
+        graph = section.flatten_graph()
+
+        backend = ForwardAccumulationBackend()
+        backend.init_capabilities(graph.ops)
+
+        feed = {f.identifier: [1.0] * n_samples for f in feeders}
+        variable_feed = {v.identifier: 0.5 for v in thetas}
+        active_id = thetas[0].identifier
+        backend.compile(graph)
+
+        # Boxed storage: one dict of dual numbers per sample.
+        boxed, boxed_peak = measure(lambda: [backend.sweep(graph, active_id, section.constants, variable_feed,
+                                                           {k: v[i] for k, v in feed.items()})
+                                             for i in range(n_samples)])
+        # Struct-of-arrays storage.
+        soa, soa_peak = measure(lambda: backend.batch_forward_sweep(graph, active_id, section.constants,
+                                                                    variable_feed, feed))
+        label = 'sweep results ({} nodes x {} samples)'.format(len(graph), n_samples)
+        report(label, boxed, soa)
+        report(label + ' peak', boxed_peak, soa_peak)
+
+        # Streaming: dead node values are released and only the target is kept.
+        streaming_backend = ForwardAccumulationBackend(streaming=True)
+        streaming_backend.init_capabilities(graph.ops)
+        streamed, streamed_peak = measure(lambda: streaming_backend.batch_forward_sweep(
+            graph, active_id, section.constants, variable_feed, feed, loss_node.identifier))
+        report('sweep results, streaming (target only)', soa, streamed)
+        report('sweep results, streaming peak', soa_peak, streamed_peak)
+
+        # Vectorized sweeps repeated like optimizer steps, with fresh temporaries vs. the preallocated buffer pool.
+        def repeated_sweeps(vectorized_backend, steps=10):
+            for _ in range(steps):
+                vectorized_backend.sweep(graph, active_id, section.constants, variable_feed, feed_arrays,
+                                         loss_node.identifier)
+
+        feed_arrays = {k: np.asarray(v) for k, v in feed.items()}
+        fresh_backend = ForwardAccumulationBackend(vectorized=True)
+        buffered_backend = ForwardAccumulationBackend(vectorized=True, reuse_buffers=True)
+        for vectorized_backend in (fresh_backend, buffered_backend):
+            vectorized_backend.init_capabilities(graph.ops)
+            repeated_sweeps(vectorized_backend, steps=1)
+        _, fresh_peak = measure(lambda: repeated_sweeps(fresh_backend))
+        _, buffered_peak = measure(lambda: repeated_sweeps(buffered_backend))
+        report('vectorized sweeps peak, buffer reuse', fresh_peak, buffered_peak)
+
+
+if __name__ == '__main__':
+    main()
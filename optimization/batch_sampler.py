@@ -0,0 +1,129 @@
+import queue
+import threading
+
+import numpy as np
+
+
+class BatchSampler:
+    """
+    Mini-batch sampler over feeder columns held as NumPy arrays (in memory or memory-mapped).
+
+    Every epoch visits all the samples once, including the last partial batch. When shuffling, each epoch draws one
+    permutation of the sample indices and the batches are index-array views into it, s.t. the only copy made is the
+    gather of the batch values themselves. Without shuffling, batches are plain slices (views) of the columns.
+
+    With prefetch enabled, a background thread prepares the next batches while the current one is being processed.
+    Errors raised while preparing a batch are re-raised by next_batch.
+    """
+
+    def __init__(self, feed_dict, batch_size, shuffle=True, prefetch=False, prefetch_depth=2, seed=None):
+        """
+        :param feed_dict:       Dict mapping feeder ids to a list/array of values, or to a feed source backed by an
+                                array (i.e. ArrayFeedSource, MemmapFeedSource).
+        :param batch_size:      Number of samples per batch.
+        :param shuffle:         Whether to shuffle the samples at the start of every epoch.
+        :param prefetch:        Whether to prepare batches on a background thread.
+        :param prefetch_depth:  Maximum number of batches prepared ahead.
+        :param seed:            Seed of the shuffling generator.
+        """
+
+        self.columns = {fid: _as_array(vals) for fid, vals in feed_dict.items()}
+        self.length = min([len(column) for column in self.columns.values()], default=0)
+        if self.length == 0:
+            raise ValueError('Cannot sample batches from an empty feed.')
+        if batch_size < 1:
+            raise ValueError('The batch size must be positive. Got {}.'.format(batch_size))
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+        # Epoch of the last batch handed out by next_batch.
+        self.epoch = 0
+
+        self._batches = self._iterate()
+
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        if prefetch:
+            self._queue = queue.Queue(maxsize=prefetch_depth)
+            self._thread = threading.Thread(target=self._prefetch, daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        # Number of batches per epoch.
+        return -(-self.length // self.batch_size)
+
+    def _iterate(self):
+        # Yields tuples (epoch, batch).
+        epoch = 0
+        while True:
+            if self.shuffle:
+                order = self.rng.permutation(self.length)
+                for start in range(0, self.length, self.batch_size):
+                    indices = order[start:start + self.batch_size]
+                    yield epoch, {fid: column[indices] for fid, column in self.columns.items()}
+            else:
+                for start in range(0, self.length, self.batch_size):
+                    yield epoch, {fid: column[start:start + self.batch_size] for fid, column in self.columns.items()}
+            epoch += 1
+
+    def _prefetch(self):
+        while not self._stop.is_set():
+            try:
+                item = next(self._batches)
+            except Exception as error:
+                # Handed to the consumer, which re-raises it. The thread stops there.
+                item = error
+
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if isinstance(item, Exception):
+                return
+
+    def next_batch(self):
+        """
+        :return:    A dict mapping feeder ids to the arrays of values of the next batch.
+        """
+
+        if self._queue is None:
+            item = next(self._batches)
+        else:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                # Keep failing on later calls instead of blocking on the stopped thread.
+                self._queue.put(item)
+                raise item
+
+        self.epoch, batch = item
+        return batch
+
+    def close(self):
+        """
+        Stops the prefetching thread, if any.
+        """
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+def _as_array(values):
+    if isinstance(values, np.ndarray):
+        return values
+
+    array = getattr(values, 'values', None)
+    if isinstance(array, np.ndarray):
+        return array
+
+    if hasattr(values, 'read'):
+        raise ValueError('Batch sampling needs random access. Feed sources must be backed by an array.')
+
+    return np.asarray(values, dtype=float)
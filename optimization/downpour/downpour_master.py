@@ -72,7 +72,13 @@ class DownpourMasterProtocol(Protocol):
 
 class DownpourSGD(Optimizer):
     def __init__(self, worker_addresses, learning_rate, epsilon, batch_size=32, max_iterations=1000, steps=5,
-                 backend=None):
+                 backend=None, optimizer_factory=MiniBatchSGD):
+        """
+        :param optimizer_factory:   Builds the worker-side optimizer from the keyword arguments learning_rate,
+                                    epsilon, batch_size, max_iterations and backend. e.g. MiniBatchSGD, MomentumSGD,
+                                    RMSProp, Adam, or a functools.partial of one of them setting its hyperparameters.
+        """
+
         super().__init__()
 
         self.worker_addresses = worker_addresses
@@ -84,6 +90,7 @@ class DownpourSGD(Optimizer):
         self.optimizer_max_it = max_iterations
         self.backend = backend
         self.steps = steps
+        self.optimizer_factory = optimizer_factory
 
         # Distributed state
         self.iterations = 0
@@ -113,10 +120,11 @@ class DownpourSGD(Optimizer):
             self.protocols.append(protocol)
 
         # Init the optimizer.
-        # TODO: would be cool to have a local optimizer factory for this use case.
-        # The factory would be sent as parameter to the master constructor
-        optimizer = MiniBatchSGD(self.optimizer_lr, self.optimizer_eps, self.optimizer_batch, self.optimizer_max_it,
-                                 self.backend)
+        optimizer = self.optimizer_factory(learning_rate=self.optimizer_lr,
+                                           epsilon=self.optimizer_eps,
+                                           batch_size=self.optimizer_batch,
+                                           max_iterations=self.optimizer_max_it,
+                                           backend=self.backend)
         protocol.set_model(optimizer, graph, variable_ids, loss_id, feed_dict_part, variable_init_feed_dict,
                            constant_feed_dict)
 
@@ -0,0 +1,167 @@
+import numpy as np
+
+
+class FeedSource:
+    """
+    A column of feeder values that is read lazily, one batch at a time.
+    """
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def read(self, start, stop):
+        """
+        Reads the values in the range [start, stop). The range is clipped to the length of the source.
+
+        :param start:   Index of the first value.
+        :param stop:    Index after the last value.
+        :return:        A NumPy array holding the values.
+        """
+
+        raise NotImplementedError()
+
+
+class ArrayFeedSource(FeedSource):
+    """
+    In-memory column. Reads are views into the array.
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=float)
+
+    def __len__(self):
+        return len(self.values)
+
+    def read(self, start, stop):
+        return self.values[start:stop]
+
+
+class MemmapFeedSource(FeedSource):
+    """
+    Memory-mapped column, backed by a .npy file or a raw binary file. Only the pages of the batches being read are
+    loaded, s.t. memory stays flat regardless of the size of the file.
+    """
+
+    def __init__(self, path, dtype=None, offset=0, length=None):
+        """
+        :param path:    Path of the .npy file, or of the raw binary file.
+        :param dtype:   Type of the values in a raw binary file. Ignored for .npy files.
+        :param offset:  Byte offset of the first value in a raw binary file. Ignored for .npy files.
+        :param length:  Number of values in a raw binary file. By default, the values run until the end of the file.
+        """
+
+        if str(path).endswith('.npy'):
+            self.values = np.load(path, mmap_mode='r')
+        else:
+            if dtype is None:
+                raise ValueError('The dtype of a raw binary feed source must be specified.')
+            shape = None if length is None else (length,)
+            self.values = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+        if self.values.ndim != 1:
+            raise ValueError('A feed source holds a single column. Got shape {}.'.format(self.values.shape))
+
+    def __len__(self):
+        return len(self.values)
+
+    def read(self, start, stop):
+        return np.asarray(self.values[start:stop], dtype=float)
+
+
+class GeneratorFeedSource(FeedSource):
+    """
+    Column produced by a generator, read sequentially. Reading before the current position restarts the generator
+    (i.e. a new epoch), s.t. only the values of the current chunk are held in memory.
+    """
+
+    def __init__(self, generator_factory, length=None, chunked=False):
+        """
+        :param generator_factory:   A callable returning a new iterator over the values (e.g. a generator function).
+        :param length:              Number of values produced by an iterator. If not set, it is counted by running
+                                    through one iterator.
+        :param chunked:             Whether the iterators yield chunks (arrays/lists of values) instead of values.
+        """
+
+        self.generator_factory = generator_factory
+        self.chunked = chunked
+
+        self._iterator = None
+        self._position = 0
+        self._buffer = np.zeros(0)
+
+        if length is None:
+            length = sum(len(chunk) for chunk in self._chunks()) if chunked else sum(1 for _ in generator_factory())
+        self.length = length
+
+        self._restart()
+
+    def __len__(self):
+        return self.length
+
+    def _chunks(self):
+        if self.chunked:
+            return iter(self.generator_factory())
+        return _chunk_iterator(self.generator_factory())
+
+    def _restart(self):
+        self._iterator = self._chunks()
+        self._position = 0
+        self._buffer = np.zeros(0)
+
+    def _fill(self, count):
+        # Pull chunks until the buffer holds at least <count> values, or the iterator is exhausted.
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        while buffered < count:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            chunks.append(np.asarray(chunk, dtype=float))
+            buffered += len(chunks[-1])
+
+        if len(chunks) > 1:
+            self._buffer = np.concatenate(chunks)
+
+    def read(self, start, stop):
+        stop = min(stop, self.length)
+        if start >= stop:
+            return np.zeros(0)
+
+        if start < self._position:
+            self._restart()
+
+        # Skip to start, then read up to stop.
+        self._fill(start - self._position)
+        self._buffer = self._buffer[start - self._position:]
+        self._position = start
+
+        self._fill(stop - start)
+        values = self._buffer[:stop - start]
+        self._buffer = self._buffer[stop - start:]
+        self._position = start + len(values)
+
+        return values
+
+
+def as_feed_source(values):
+    """
+    Wraps the values of a feeder in a feed source, unless they already are one.
+
+    :param values:  A FeedSource, or a list/array of values.
+    :return:        A FeedSource.
+    """
+
+    if isinstance(values, FeedSource):
+        return values
+    return ArrayFeedSource(values)
+
+
+def _chunk_iterator(iterator, chunk_size=1024):
+    chunk = []
+    for value in iterator:
+        chunk.append(value)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
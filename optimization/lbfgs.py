@@ -0,0 +1,212 @@
+from collections import deque
+
+import numpy as np
+
+from optimization.optimizer import Optimizer
+from optimization.feed_sources import as_feed_source
+from optimization.parameter_state import ParameterState
+
+
+class LBFGS(Optimizer):
+    """
+    Full-batch limited-memory BFGS. The inverse Hessian is approximated from the last <history_size> curvature pairs
+    (s = step, y = gradient change) through the two-loop recursion, and every step is taken along the resulting
+    direction with a line search satisfying the strong Wolfe conditions.
+
+    The objective is the average of the loss over the feed. Each evaluation (of the iterations and of the line search
+    trials) gets the loss and the gradient from a single backend call (value_and_gradients).
+    """
+
+    def __init__(self, history_size=10, max_iterations=100, tolerance=1e-6, tolerance_change=1e-9, backend=None,
+                 c1=1e-4, c2=0.9, max_line_search=20):
+        """
+        :param history_size:        Number of curvature pairs kept.
+        :param max_iterations:      Maximum number of iterations.
+        :param tolerance:           Convergence threshold on the largest gradient entry.
+        :param tolerance_change:    Convergence threshold on the (relative) change in loss between iterations.
+        :param backend:             The backend computing the loss and gradients.
+        :param c1:                  Sufficient decrease constant of the line search.
+        :param c2:                  Curvature constant of the line search.
+        :param max_line_search:     Maximum number of evaluations per line search.
+        """
+
+        super().__init__()
+        self.backend = backend
+
+        self.history_size = history_size
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.tolerance_change = tolerance_change
+        self.c1 = c1
+        self.c2 = c2
+        self.max_line_search = max_line_search
+
+        self.state = None
+        self.iterations = 0
+        self.evaluations = 0
+        self.converged = False
+
+        self._objective_args = None
+
+    def get_variable_values(self):
+        return self.state.as_dict()
+
+    def optimize(self, graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict):
+        feed_dict = {fid: as_feed_source(vals) for fid, vals in feed_dict.items()}
+        feed_length = min([len(source) for source in feed_dict.values()])
+        feed_dict = {fid: source.read(0, feed_length) for fid, source in feed_dict.items()}
+        self._objective_args = (graph, loss_id, feed_dict, constant_feed_dict)
+
+        self.state = ParameterState(variable_init_feed_dict)
+        self.iterations = 0
+        self.evaluations = 0
+        self.converged = False
+
+        history = deque(maxlen=self.history_size)
+        x = self.state.values.copy()
+        loss, gradient = self.evaluate(x)
+
+        while self.iterations < self.max_iterations:
+            if np.max(np.abs(gradient), initial=0.0) <= self.tolerance:
+                self.converged = True
+                break
+
+            direction = -_two_loop(gradient, history)
+            if np.dot(direction, gradient) >= 0:
+                # Not a descent direction (e.g. after a poor curvature pair): fall back to steepest descent.
+                history.clear()
+                direction = -gradient
+
+            # The first step is scaled s.t. it is of unit length, later ones rely on the curvature history.
+            initial_step = 1.0 if len(history) > 0 else min(1.0, 1.0 / np.linalg.norm(gradient))
+            step, new_loss, new_gradient = self.line_search(x, loss, gradient, direction, initial_step)
+            if step is None:
+                break
+
+            s = step * direction
+            y = new_gradient - gradient
+            if np.dot(s, y) > 1e-10:
+                history.append((s, y))
+
+            x = x + s
+            loss_change = abs(loss - new_loss)
+            loss, gradient = new_loss, new_gradient
+            self.iterations += 1
+
+            if loss_change <= self.tolerance_change * max(1.0, abs(loss)):
+                self.converged = True
+                break
+
+        self.state.values[:] = x
+
+    def evaluate(self, x):
+        """
+        :param x:   A parameter vector.
+        :return:    A tuple (average loss, gradient vector) at x.
+        """
+
+        graph, loss_id, feed_dict, constant_feed_dict = self._objective_args
+
+        self.state.values[:] = x
+        values, gradients = self.backend.value_and_gradients(graph=graph,
+                                                             target_node_id=loss_id,
+                                                             feed_dict=feed_dict,
+                                                             variable_feed_dict=self.state.as_dict(),
+                                                             constant_feed_dict=constant_feed_dict,
+                                                             reduce_strategy='avg')
+        self.evaluations += 1
+
+        return float(np.mean(values)), self.state.flatten(gradients)
+
+    def line_search(self, x, loss, gradient, direction, initial_step):
+        """
+        Searches a step along the direction satisfying the strong Wolfe conditions (Nocedal & Wright, algorithms 3.5
+        and 3.6), bracketing then zooming with safeguarded cubic interpolation.
+
+        :return:    A tuple (step, loss, gradient) at the accepted point, or (None, None, None) if no step was found.
+        """
+
+        slope = np.dot(gradient, direction)
+
+        previous = (0.0, loss, slope, gradient)
+        step = initial_step
+        for i in range(self.max_line_search):
+            step_loss, step_gradient = self.evaluate(x + step * direction)
+            step_slope = np.dot(step_gradient, direction)
+            current = (step, step_loss, step_slope, step_gradient)
+
+            if (step_loss > loss + self.c1 * step * slope) or ((i > 0) and (step_loss >= previous[1])):
+                return self._zoom(x, loss, slope, direction, previous, current, self.max_line_search - i - 1)
+            if abs(step_slope) <= -self.c2 * slope:
+                return step, step_loss, step_gradient
+            if step_slope >= 0:
+                return self._zoom(x, loss, slope, direction, current, previous, self.max_line_search - i - 1)
+
+            previous = current
+            step = 2 * step
+
+        return None, None, None
+
+    def _zoom(self, x, loss, slope, direction, low, high, evaluations):
+        # low and high are tuples (step, loss, slope, gradient) bracketing an acceptable step. low has the lower loss.
+        for _ in range(evaluations):
+            step = _cubic_minimizer(low[0], low[1], low[2], high[0], high[1], high[2])
+            step_loss, step_gradient = self.evaluate(x + step * direction)
+            step_slope = np.dot(step_gradient, direction)
+            current = (step, step_loss, step_slope, step_gradient)
+
+            if (step_loss > loss + self.c1 * step * slope) or (step_loss >= low[1]):
+                high = current
+            else:
+                if abs(step_slope) <= -self.c2 * slope:
+                    return step, step_loss, step_gradient
+                if step_slope * (high[0] - low[0]) >= 0:
+                    high = low
+                low = current
+
+        # Accept the best step found if it decreases the loss.
+        if (low[0] > 0) and (low[1] < loss):
+            return low[0], low[1], low[3]
+        return None, None, None
+
+
+def _two_loop(gradient, history):
+    """
+    Two-loop recursion: multiplies the gradient by the inverse Hessian approximation of the curvature history.
+    """
+
+    q = gradient.copy()
+    alphas = []
+    for s, y in reversed(history):
+        alpha = np.dot(s, q) / np.dot(y, s)
+        q -= alpha * y
+        alphas.append(alpha)
+
+    if len(history) > 0:
+        s, y = history[-1]
+        q *= np.dot(s, y) / np.dot(y, y)
+
+    for (s, y), alpha in zip(history, reversed(alphas)):
+        beta = np.dot(y, q) / np.dot(y, s)
+        q += (alpha - beta) * s
+
+    return q
+
+
+def _cubic_minimizer(a, fa, ga, b, fb, gb):
+    """
+    Minimizer of the cubic interpolating the loss and slope at steps a and b, kept away from the ends of the interval
+    (bisection if the interpolation fails).
+    """
+
+    lower, upper = min(a, b), max(a, b)
+    d1 = ga + gb - 3 * (fa - fb) / (a - b)
+    radicand = d1 * d1 - ga * gb
+    if radicand >= 0:
+        d2 = np.sign(b - a) * np.sqrt(radicand)
+        step = b - (b - a) * (gb + d2 - d1) / (gb - ga + 2 * d2)
+        margin = 0.1 * (upper - lower)
+        if np.isfinite(step) and (lower + margin <= step <= upper - margin):
+            return step
+
+    return (lower + upper) / 2
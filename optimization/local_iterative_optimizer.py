@@ -1,4 +1,9 @@
+import numpy as np
+
 from optimization.optimizer import Optimizer
+from optimization.parameter_state import ParameterState
+from optimization.feed_sources import as_feed_source
+from optimization.batch_sampler import BatchSampler
 
 
 class IterativeOptimizer(Optimizer):
@@ -6,7 +11,7 @@ class IterativeOptimizer(Optimizer):
     def __init__(self, gradients_f):
         super().__init__()
         self.backend = gradients_f
-        self.variable_info = {}
+        self.state = None
         self.feed_dict = None
         self.feed_length = 0
         self.constant_feed_dict = None
@@ -15,62 +20,75 @@ class IterativeOptimizer(Optimizer):
         self.graph = None
 
     def get_variable_values(self):
-        return {k: v['current_value'] for k, v in self.variable_info.items()}
+        return self.state.as_dict()
 
-    def update_rule(self, vid, gradients):
-        raise NotImplementedError()
+    def update_rule(self, gradient):
+        """
+        Updates the parameters of the state.
+
+        :param gradient:    The gradient vector, laid out like the parameter vector of the state.
+        """
 
-    def init_variable(self, vid, init_value):
         raise NotImplementedError()
 
+    def init_state(self, variable_init_feed_dict):
+        self.state = ParameterState(variable_init_feed_dict)
+
     def has_converged(self):
-        raise NotImplementedError()
+        return self.state.all_converged()
 
     def gather_gradients(self, graph, variable_ids, loss_id):
         raise NotImplementedError()
 
     def make_variable_feed_dict(self):
-        return {k: v['current_value'] for k, v in self.variable_info.items()}
+        return self.state.as_dict()
+
+    def set_feed_dict(self, feed_dict):
+        """
+        Registers the training data. Every feeder column is wrapped in a feed source, s.t. batches are read lazily.
+
+        :param feed_dict:   Dict mapping feeder ids to a list/array of values or to a FeedSource.
+        """
+
+        self.feed_dict = {fid: as_feed_source(vals) for fid, vals in feed_dict.items()}
+        self.feed_length = min([len(source) for source in self.feed_dict.values()])
 
     def init_optimizer(self, graph, feed_dict, constant_feed_dict, variable_ids, loss_id):
         self.constant_feed_dict = constant_feed_dict
-        self.feed_dict = feed_dict
-        self.feed_length = min([len(vs) for vs in feed_dict.values()])
+        self.set_feed_dict(feed_dict)
         self.loss_id = loss_id
         self.variable_ids = variable_ids
         self.graph = graph
 
     def optimize_step(self, variable_feed_dict, iterations):
-        self.variable_info = {}
-        for vid, init_value in variable_feed_dict.items():
-            self.init_variable(vid, init_value)
+        # Each round restarts from the given values, while the optimizer statistics (e.g. moments) carry over.
+        if self.state is None:
+            self.init_state(variable_feed_dict)
+        else:
+            self.state = self.state.restart(variable_feed_dict)
 
         for _ in range(iterations):
             vid_grad_map = self.gather_gradients(self.graph, self.variable_ids, self.loss_id)
-            for vid, grads in vid_grad_map.items():
-                self.update_rule(vid, grads)
+            self.update_rule(self.state.flatten(vid_grad_map))
 
         return self.get_variable_values()
 
     def optimize(self, graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict):
         self.constant_feed_dict = constant_feed_dict
-        self.feed_dict = feed_dict
-        self.feed_length = min([len(vals) for vals in feed_dict.values()])
+        self.set_feed_dict(feed_dict)
 
         # TODO: extend to a initialization policy (maybe upstream, tho)
-        self.variable_info = {}
-        for vid, init_value in variable_init_feed_dict.items():
-            self.init_variable(vid, init_value)
+        self.init_state(variable_init_feed_dict)
 
         while not self.has_converged():
             vid_grad_map = self.gather_gradients(graph, variable_ids, loss_id)
-            for vid, grads in vid_grad_map.items():
-                self.update_rule(vid, grads)
+            self.update_rule(self.state.flatten(vid_grad_map))
 
 
 class MiniBatchSGD(IterativeOptimizer):
 
-    def __init__(self, learning_rate, epsilon, batch_size=32, max_iterations=1000, backend=None):
+    def __init__(self, learning_rate, epsilon, batch_size=32, max_iterations=1000, backend=None, shuffle=False,
+                 prefetch=False, seed=None):
         super().__init__(backend)
 
         self.learning_rate = learning_rate
@@ -79,40 +97,82 @@ class MiniBatchSGD(IterativeOptimizer):
         self.batch_size = batch_size
         self.current_batch_ix = 0
 
-    def update_rule(self, vid, gradient):
-        var_info = self.variable_info[vid]
-        if not var_info['converged']:
-            var_info['iterations'] += 1
+        # Batches are drawn from a sampler when shuffling or prefetching, sequentially from the feed sources otherwise.
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.seed = seed
+        self.sampler = None
 
-            old_value = var_info['current_value']
-            new_value = old_value - (self.learning_rate * gradient)
-            var_info['current_value'] = new_value
+    def set_feed_dict(self, feed_dict):
+        super().set_feed_dict(feed_dict)
 
-            if (abs(new_value - old_value) <= self.epsilon) or (var_info['iterations'] >= self.max_iterations):
-                var_info['converged'] = True
+        self.release_sampler()
+        if self.shuffle or self.prefetch:
+            self.sampler = BatchSampler(self.feed_dict, self.batch_size, shuffle=self.shuffle, prefetch=self.prefetch,
+                                        seed=self.seed)
 
-    def init_variable(self, vid, init_value):
-        self.variable_info[vid] = {
-            'current_value': init_value,
-            'iterations': 0,
-            'converged': False
-        }
+    def release_sampler(self):
+        if self.sampler is not None:
+            self.sampler.close()
+            self.sampler = None
 
-    def has_converged(self):
-        return all([info['converged'] for info in self.variable_info.values()])
+    def optimize(self, graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict):
+        try:
+            super().optimize(graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict)
+        finally:
+            self.release_sampler()
+
+    def update_rule(self, gradient):
+        state = self.state
+        active = ~state.converged
+
+        # Converged parameters are frozen.
+        step = np.where(active, self.step(gradient, active), 0.0)
+        state.values -= step
+        state.iterations += active
+
+        state.converged |= active & ((self.change(gradient, step) <= self.epsilon) |
+                                     (state.iterations >= self.max_iterations))
+
+    def change(self, gradient, step):
+        """
+        :param gradient:    The gradient vector.
+        :param step:        The step vector.
+        :return:            The per-parameter change compared with epsilon to detect convergence (the step size).
+        """
+
+        return np.abs(step)
+
+    def step(self, gradient, active):
+        """
+        Computes the step subtracted from the parameters.
+
+        :param gradient:    The gradient vector.
+        :param active:      Mask of the parameters that have not converged yet. Statistics of the other parameters must
+                            be left unchanged.
+        :return:            The step vector.
+        """
+
+        return self.learning_rate * gradient
 
     def next_batch(self):
+        if self.sampler is not None:
+            return self.sampler.next_batch()
+
+        if self.feed_length == 0:
+            raise ValueError('Cannot draw batches from an empty feed.')
 
+        # The last batch of an epoch holds the remaining samples, the next one starts over.
         start_ix = self.current_batch_ix
-        end_ix = start_ix + self.batch_size
+        end_ix = min(start_ix + self.batch_size, self.feed_length)
 
         if end_ix >= self.feed_length:
             self.current_batch_ix = 0
         else:
             self.current_batch_ix = end_ix
 
-        return {fid: vals[start_ix:end_ix]
-                for fid, vals in self.feed_dict.items()}
+        return {fid: source.read(start_ix, end_ix)
+                for fid, source in self.feed_dict.items()}
 
     def gather_gradients(self, graph, variable_ids, loss_id):
         next_batch = self.next_batch()
@@ -124,3 +184,91 @@ class MiniBatchSGD(IterativeOptimizer):
                                       variable_feed_dict=variable_feed_dict,
                                       constant_feed_dict=self.constant_feed_dict,
                                       reduce_strategy='avg')
+
+
+class MomentumSGD(MiniBatchSGD):
+    """
+    Mini-batch SGD with (heavy ball) momentum, or Nesterov momentum:
+
+    v = momentum * v + g
+    step = learning_rate * v                        (heavy ball)
+    step = learning_rate * (g + momentum * v)       (Nesterov)
+    """
+
+    def __init__(self, learning_rate, epsilon, momentum=0.9, nesterov=False, **kwargs):
+        super().__init__(learning_rate, epsilon, **kwargs)
+
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def step(self, gradient, active):
+        velocity = self.state.moment('velocity')
+        velocity[active] = self.momentum * velocity[active] + gradient[active]
+
+        if self.nesterov:
+            return self.learning_rate * (gradient + self.momentum * velocity)
+        return self.learning_rate * velocity
+
+
+class RMSProp(MiniBatchSGD):
+    """
+    Mini-batch SGD scaling the steps by a running average of the squared gradients:
+
+    s = decay * s + (1 - decay) * g^2
+    step = learning_rate * g / (sqrt(s) + delta)
+    """
+
+    def __init__(self, learning_rate, epsilon, decay=0.9, delta=1e-8, **kwargs):
+        super().__init__(learning_rate, epsilon, **kwargs)
+
+        self.decay = decay
+        self.delta = delta
+
+    def step(self, gradient, active):
+        square_average = self.state.moment('square_average')
+        square_average[active] = self.decay * square_average[active] + (1 - self.decay) * gradient[active] ** 2
+
+        return self.learning_rate * gradient / (np.sqrt(square_average) + self.delta)
+
+    def change(self, gradient, step):
+        # The adaptive step is about learning_rate * sign(g) and does not shrink with the gradient, so convergence is
+        # tested on the plain SGD step instead.
+        return self.learning_rate * np.abs(gradient)
+
+
+class Adam(MiniBatchSGD):
+    """
+    Mini-batch SGD with bias-corrected running averages of the gradients and squared gradients (Kingma & Ba, 2015):
+
+    m = beta1 * m + (1 - beta1) * g
+    v = beta2 * v + (1 - beta2) * g^2
+    step = learning_rate * (m / (1 - beta1^t)) / (sqrt(v / (1 - beta2^t)) + delta)
+    """
+
+    def __init__(self, learning_rate, epsilon, beta1=0.9, beta2=0.999, delta=1e-8, **kwargs):
+        super().__init__(learning_rate, epsilon, **kwargs)
+
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.delta = delta
+
+    def step(self, gradient, active):
+        first_moment = self.state.moment('first_moment')
+        second_moment = self.state.moment('second_moment')
+        steps = self.state.moment('steps')
+
+        steps[active] += 1
+        first_moment[active] = self.beta1 * first_moment[active] + (1 - self.beta1) * gradient[active]
+        second_moment[active] = self.beta2 * second_moment[active] + (1 - self.beta2) * gradient[active] ** 2
+
+        # Frozen parameters that were never updated have no statistics yet. Their step is masked out anyway.
+        t = np.maximum(steps, 1)
+        first_corrected = first_moment / (1 - self.beta1 ** t)
+        second_corrected = second_moment / (1 - self.beta2 ** t)
+
+        return self.learning_rate * first_corrected / (np.sqrt(second_corrected) + self.delta)
+
+    def change(self, gradient, step):
+        # The adaptive step is about learning_rate * sign(g) and does not shrink with the gradient, so convergence is
+        # tested on the plain SGD step instead.
+        return self.learning_rate * np.abs(gradient)
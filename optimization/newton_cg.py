@@ -0,0 +1,204 @@
+import numpy as np
+
+from optimization.optimizer import Optimizer
+from optimization.feed_sources import as_feed_source
+from optimization.parameter_state import ParameterState
+
+
+class NewtonCG(Optimizer):
+    """
+    Full-batch truncated Newton (Newton-CG). Every iteration solves the Newton system H p = -g approximately with
+    conjugate gradients, where the Hessian is only accessed through Hessian-vector products computed by the backend,
+    then takes a backtracking (Armijo) line search along p.
+
+    CG stops at a relative residual of min(0.5, sqrt(|g|)) (superlinear convergence near the minimum), or when it meets
+    a direction of non-positive curvature. With preconditioning, the Hessian diagonal (when positive) is used as a
+    Jacobi preconditioner, which takes care of badly scaled variables.
+
+    The backend must provide value_and_gradients and hessian_vector_product (and hessian_diagonal if preconditioned).
+    ReverseAccumulationBackend computes the products forward-over-reverse, in a fixed number of passes, s.t. a CG
+    iteration costs about as much as a gradient. ForwardAccumulationBackend computes them forward-over-forward, with
+    one nested sweep per variable (per chunk of <lanes> variables), i.e. a CG iteration costs O(N) sweeps for N
+    parameters and a Newton iteration up to O(N^2); it also provides hessian_diagonal, for preconditioning.
+    """
+
+    def __init__(self, max_iterations=50, tolerance=1e-6, max_cg_iterations=None, preconditioned=False, backend=None,
+                 c1=1e-4, max_line_search=20):
+        """
+        :param max_iterations:      Maximum number of Newton iterations.
+        :param tolerance:           Convergence threshold on the largest gradient entry.
+        :param max_cg_iterations:   Maximum number of CG iterations per Newton iteration. Defaults to the number of
+                                    parameters.
+        :param preconditioned:      Whether to precondition CG with the Hessian diagonal.
+        :param backend:             The backend computing the loss, gradients and Hessian-vector products.
+        :param c1:                  Sufficient decrease constant of the line search.
+        :param max_line_search:     Maximum number of step halvings per line search.
+        """
+
+        super().__init__()
+        self.backend = backend
+
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        self.max_cg_iterations = max_cg_iterations
+        self.preconditioned = preconditioned
+        self.c1 = c1
+        self.max_line_search = max_line_search
+
+        self.state = None
+        self.iterations = 0
+        self.evaluations = 0
+        self.hessian_products = 0
+        self.converged = False
+
+        self._objective_args = None
+
+    def get_variable_values(self):
+        return self.state.as_dict()
+
+    def optimize(self, graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict):
+        if not hasattr(self.backend, 'hessian_vector_product'):
+            raise ValueError('Newton-CG needs a backend computing Hessian-vector products. Got {}.'
+                             .format(getattr(self.backend, 'name', self.backend)))
+        if self.preconditioned and not hasattr(self.backend, 'hessian_diagonal'):
+            raise ValueError('Preconditioned Newton-CG needs a backend computing the Hessian diagonal. Got {}.'
+                             .format(getattr(self.backend, 'name', self.backend)))
+
+        feed_dict = {fid: as_feed_source(vals) for fid, vals in feed_dict.items()}
+        feed_length = min([len(source) for source in feed_dict.values()])
+        feed_dict = {fid: source.read(0, feed_length) for fid, source in feed_dict.items()}
+        self._objective_args = (graph, loss_id, feed_dict, constant_feed_dict)
+
+        self.state = ParameterState(variable_init_feed_dict)
+        self.iterations = 0
+        self.evaluations = 0
+        self.hessian_products = 0
+        self.converged = False
+
+        x = self.state.values.copy()
+        loss, gradient = self.evaluate(x)
+
+        while self.iterations < self.max_iterations:
+            if np.max(np.abs(gradient), initial=0.0) <= self.tolerance:
+                self.converged = True
+                break
+
+            direction = self.newton_direction(x, gradient)
+
+            step, new_loss, new_gradient = self.line_search(x, loss, gradient, direction)
+            if step is None:
+                break
+
+            x = x + step * direction
+            loss, gradient = new_loss, new_gradient
+            self.iterations += 1
+
+        self.state.values[:] = x
+
+    def evaluate(self, x):
+        """
+        :param x:   A parameter vector.
+        :return:    A tuple (average loss, gradient vector) at x.
+        """
+
+        graph, loss_id, feed_dict, constant_feed_dict = self._objective_args
+
+        self.state.values[:] = x
+        values, gradients = self.backend.value_and_gradients(graph=graph,
+                                                             target_node_id=loss_id,
+                                                             feed_dict=feed_dict,
+                                                             variable_feed_dict=self.state.as_dict(),
+                                                             constant_feed_dict=constant_feed_dict,
+                                                             reduce_strategy='avg')
+        self.evaluations += 1
+
+        return float(np.mean(values)), self.state.flatten(gradients)
+
+    def hessian_product(self, x, vector):
+        """
+        :param x:       A parameter vector.
+        :param vector:  A vector laid out like the parameters.
+        :return:        The product of the Hessian of the average loss at x with the vector.
+        """
+
+        graph, loss_id, feed_dict, constant_feed_dict = self._objective_args
+
+        self.state.values[:] = x
+        products = self.backend.hessian_vector_product(graph=graph,
+                                                       target_node_id=loss_id,
+                                                       feed_dict=feed_dict,
+                                                       variable_feed_dict=self.state.as_dict(),
+                                                       constant_feed_dict=constant_feed_dict,
+                                                       vector=self.state.unflatten(vector),
+                                                       reduce_strategy='avg')
+        self.hessian_products += 1
+
+        return self.state.flatten(products)
+
+    def newton_direction(self, x, gradient):
+        """
+        Solves H p = -g approximately with (preconditioned) conjugate gradients.
+
+        :param x:           The current parameter vector.
+        :param gradient:    The gradient at x.
+        :return:            The search direction, a descent direction.
+        """
+
+        preconditioner = np.ones(len(x))
+        if self.preconditioned:
+            graph, loss_id, feed_dict, constant_feed_dict = self._objective_args
+            self.state.values[:] = x
+            diagonal = self.state.flatten(self.backend.hessian_diagonal(graph=graph,
+                                                                        target_node_id=loss_id,
+                                                                        feed_dict=feed_dict,
+                                                                        variable_feed_dict=self.state.as_dict(),
+                                                                        constant_feed_dict=constant_feed_dict,
+                                                                        reduce_strategy='avg'))
+            preconditioner = np.where(diagonal > 0, diagonal, 1.0)
+
+        gradient_norm = np.linalg.norm(gradient)
+        residual_tolerance = min(0.5, np.sqrt(gradient_norm)) * gradient_norm
+        max_cg_iterations = len(x) if self.max_cg_iterations is None else self.max_cg_iterations
+
+        p = np.zeros(len(x))
+        residual = -gradient
+        z = residual / preconditioner
+        d = z.copy()
+        rz = np.dot(residual, z)
+        for _ in range(max_cg_iterations):
+            hd = self.hessian_product(x, d)
+            curvature = np.dot(d, hd)
+            if curvature <= 0:
+                # Non-positive curvature: stop with the current iterate (steepest descent if there is none yet).
+                return -gradient if not p.any() else p
+
+            alpha = rz / curvature
+            p = p + alpha * d
+            residual = residual - alpha * hd
+            if np.linalg.norm(residual) <= residual_tolerance:
+                break
+
+            z = residual / preconditioner
+            rz_next = np.dot(residual, z)
+            d = z + (rz_next / rz) * d
+            rz = rz_next
+
+        return p
+
+    def line_search(self, x, loss, gradient, direction):
+        """
+        Backtracking line search from the full Newton step, halving it until the Armijo condition holds.
+
+        :return:    A tuple (step, loss, gradient) at the accepted point, or (None, None, None) if no step was found.
+        """
+
+        slope = np.dot(gradient, direction)
+
+        step = 1.0
+        for _ in range(self.max_line_search):
+            step_loss, step_gradient = self.evaluate(x + step * direction)
+            if step_loss <= loss + self.c1 * step * slope:
+                return step, step_loss, step_gradient
+            step = step / 2
+
+        return None, None, None
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from autodiff.graph import FlattenedGraph
+from optimization.optimizer import Optimizer
+from optimization.feed_sources import as_feed_source
+from optimization.parameter_state import ParameterState
+from optimization.local_iterative_optimizer import MiniBatchSGD
+
+
+# Seconds between two checks of the processes and of the error queue.
+_POLL_INTERVAL = 0.1
+
+class ParallelMiniBatchSGD(Optimizer):
+    """
+    Data-parallel mini-batch SGD over a pool of local processes. The feed is split into one shard per process, and the
+    parameter vector (see ParameterState) lives in a shared memory block that every process maps, s.t. the model is
+    shipped to the processes once and the rounds exchange no messages.
+
+    Two modes are supported:
+
+    hogwild         Every process runs its own optimizer over its shard and applies its updates straight to the shared
+                    parameters, without locking. It stops when its optimizer has converged.
+    synchronous     In every round, each process writes the gradient of its next batch into its row of a shared gradient
+                    block. Once all the rows are written, the first process averages them and applies the update, then
+                    all the processes move on to the next round. This is equivalent to mini-batch SGD with batches of
+                    <workers> x <batch_size> samples.
+
+    The backend must be picklable if the processes are not forked. While the processes run, the calling process
+    collects their errors and watches their exit codes: if a process fails or dies (e.g. killed by a signal), the
+    barrier is aborted, s.t. the other processes stop instead of waiting for it.
+    """
+
+    def __init__(self, learning_rate, epsilon, batch_size=32, max_iterations=1000, workers=None, mode='hogwild',
+                 backend=None, optimizer_factory=MiniBatchSGD, start_method=None):
+        """
+        :param workers:             The number of processes. Defaults to the number of CPUs.
+        :param mode:                Either <hogwild> or <synchronous>.
+        :param optimizer_factory:   Builds the optimizer of every process from the keyword arguments learning_rate,
+                                    epsilon, batch_size, max_iterations and backend (see DownpourSGD).
+        :param start_method:        The multiprocessing start method. Defaults to the platform default.
+        """
+
+        super().__init__()
+
+        if mode not in ('hogwild', 'synchronous'):
+            raise ValueError('Unknown mode {}. Supports <hogwild> and <synchronous>.'.format(mode))
+        if (workers is not None) and (workers < 1):
+            raise ValueError('The number of workers must be positive. Got {}.'.format(workers))
+
+        self.learning_rate = learning_rate
+        self.epsilon = epsilon
+        self.batch_size = batch_size
+        self.max_iterations = max_iterations
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.mode = mode
+        self.backend = backend
+        self.optimizer_factory = optimizer_factory
+        self.start_method = start_method
+
+        self.state = None
+
+    def get_variable_values(self):
+        return self.state.as_dict()
+
+    def optimize(self, graph, variable_ids, loss_id, feed_dict, variable_init_feed_dict, constant_feed_dict):
+        self.state = ParameterState(variable_init_feed_dict)
+        n_parameters = len(self.state)
+
+        context = multiprocessing.get_context(self.start_method)
+        barrier = context.Barrier(self.workers)
+        done = context.Value('b', 0, lock=False)
+        errors = context.SimpleQueue()
+
+        # Shared memory blocks must not be empty.
+        parameters_memory = shared_memory.SharedMemory(create=True, size=max(1, n_parameters) * 8)
+        gradients_memory = shared_memory.SharedMemory(create=True, size=max(1, self.workers * n_parameters) * 8)
+        parameters = None
+        try:
+            parameters = np.ndarray((n_parameters,), dtype=np.float64, buffer=parameters_memory.buf)
+            parameters[:] = self.state.values
+
+            # The compiled state of the graph (e.g. generated code) stays with this process.
+            graph = FlattenedGraph(dict(graph), graph_hash=getattr(graph, 'graph_hash', None),
+                                   ops=getattr(graph, 'ops', None), constants=getattr(graph, 'constants', None))
+            optimizer_kwargs = {
+                'learning_rate': self.learning_rate,
+                'epsilon': self.epsilon,
+                'batch_size': self.batch_size,
+                'max_iterations': self.max_iterations,
+                'backend': self.backend
+            }
+
+            shards = _shard_feed_dict(feed_dict, self.workers)
+            processes = [context.Process(target=_run_worker,
+                                         args=(worker_id, self.mode, self.optimizer_factory, optimizer_kwargs, graph,
+                                               variable_ids, loss_id, shards[worker_id], variable_init_feed_dict,
+                                               constant_feed_dict, parameters_memory, gradients_memory, self.workers,
+                                               barrier, done, errors),
+                                         daemon=True)
+                         for worker_id in range(self.workers)]
+
+            for process in processes:
+                process.start()
+            failures = _watch_workers(processes, barrier, errors)
+
+            self.state.values[:] = parameters
+        finally:
+            # The views must be released before the blocks are closed.
+            parameters = None
+            parameters_memory.close()
+            parameters_memory.unlink()
+            gradients_memory.close()
+            gradients_memory.unlink()
+
+        if len(failures) > 0:
+            raise RuntimeError('A worker of the parallel optimizer failed:\n{}'.format(failures[0]))
+        failed = [process.exitcode for process in processes if process.exitcode != 0]
+        if len(failed) > 0:
+            raise RuntimeError('Workers of the parallel optimizer exited with codes {}.'.format(failed))
+
+
+def _run_worker(worker_id, mode, optimizer_factory, optimizer_kwargs, graph, variable_ids, loss_id, feed_dict,
+                variable_init_feed_dict, constant_feed_dict, parameters_memory, gradients_memory, workers, barrier,
+                done, errors):
+    optimizer = None
+    try:
+        optimizer = optimizer_factory(**optimizer_kwargs)
+        optimizer.init_optimizer(graph, feed_dict, constant_feed_dict, variable_ids, loss_id)
+        optimizer.init_state(variable_init_feed_dict)
+
+        # The optimizer reads and updates the shared parameters in place.
+        n_parameters = len(optimizer.state)
+        parameters = np.ndarray((n_parameters,), dtype=np.float64, buffer=parameters_memory.buf)
+        gradients = np.ndarray((workers, n_parameters), dtype=np.float64, buffer=gradients_memory.buf)
+        optimizer.state.values = parameters
+
+        if mode == 'hogwild':
+            while not optimizer.has_converged():
+                gradient = optimizer.gather_gradients(graph, variable_ids, loss_id)
+                optimizer.update_rule(optimizer.state.flatten(gradient))
+        else:
+            while True:
+                gradient = optimizer.gather_gradients(graph, variable_ids, loss_id)
+                gradients[worker_id] = optimizer.state.flatten(gradient)
+                barrier.wait()
+
+                # The first worker owns the update and the convergence state.
+                if worker_id == 0:
+                    optimizer.update_rule(np.mean(gradients, axis=0))
+                    done.value = optimizer.has_converged()
+                barrier.wait()
+
+                if done.value:
+                    break
+    except BrokenBarrierError:
+        # Another worker failed and reported it.
+        pass
+    except Exception:
+        barrier.abort()
+        errors.put(traceback.format_exc())
+    finally:
+        if hasattr(optimizer, 'release_sampler'):
+            optimizer.release_sampler()
+
+
+def _watch_workers(processes, barrier, errors):
+    """
+    Waits for the worker processes to exit. The error queue is drained while waiting, s.t. no worker blocks on a full
+    pipe when reporting its error, and the barrier is aborted as soon as a process exits with a non-zero code.
+
+    :param processes:   The started worker processes.
+    :param barrier:     The barrier shared by the workers.
+    :param errors:      The queue the workers put their tracebacks on.
+    :return:            The list of tracebacks reported by the workers.
+    """
+
+    failures = []
+    running = {process.sentinel: process for process in processes}
+    while len(running) > 0:
+        for sentinel in wait(list(running), timeout=_POLL_INTERVAL):
+            process = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                barrier.abort()
+
+        while not errors.empty():
+            failures.append(errors.get())
+
+    return failures
+
+
+def _shard_feed_dict(feed_dict, shards):
+    """
+    Splits the feed into contiguous shards of (nearly) equal length.
+
+    :param feed_dict:   Dict mapping feeder ids to a list/array of values or to a FeedSource.
+    :param shards:      The number of shards.
+    :return:            A list of feed dicts holding arrays.
+    """
+
+    sources = {fid: as_feed_source(values) for fid, values in feed_dict.items()}
+    n = min([len(source) for source in sources.values()])
+    if n < shards:
+        raise ValueError('Cannot split {} samples into {} shards.'.format(n, shards))
+
+    bounds = np.linspace(0, n, shards + 1).astype(int)
+    return [{fid: source.read(bounds[i], bounds[i + 1]) for fid, source in sources.items()} for i in range(shards)]
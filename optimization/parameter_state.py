@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class ParameterState:
+    """
+    Array-backed state of the variables being optimized. All the variables are laid out in a single parameter vector
+    (array-shaped variables take one entry per element), along with per-entry iteration counters and a convergence
+    mask, s.t. update rules and convergence checks are single NumPy operations over the whole model.
+
+    Optimizers keep their per-parameter statistics (e.g. moment estimates) in <moments>, as vectors of the same layout.
+    """
+
+    def __init__(self, variable_feed_dict):
+        """
+        :param variable_feed_dict:  Dict mapping variable ids to their initial values (scalars or arrays).
+        """
+
+        self.variable_ids = list(variable_feed_dict.keys())
+        self.shapes = [np.shape(value) for value in variable_feed_dict.values()]
+
+        sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        self.index = {vid: i for i, vid in enumerate(self.variable_ids)}
+
+        self.values = np.zeros(self.offsets[-1])
+        for i, value in enumerate(variable_feed_dict.values()):
+            self.values[self.offsets[i]:self.offsets[i + 1]] = np.ravel(value)
+
+        self.iterations = np.zeros(len(self.values), dtype=int)
+        self.converged = np.zeros(len(self.values), dtype=bool)
+        self.moments = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def value(self, vid):
+        """
+        :param vid: A variable id.
+        :return:    The current value of the variable, with its original shape (a float for scalars).
+        """
+
+        return self._entry(self.values, self.index[vid])
+
+    def as_dict(self):
+        """
+        :return:    Dict mapping variable ids to their current values.
+        """
+
+        return {vid: self.value(vid) for vid in self.variable_ids}
+
+    def unflatten(self, vector):
+        """
+        Splits a vector laid out like the parameters (e.g. a search direction) into per-variable quantities.
+
+        :param vector:  A vector of the parameter vector's length.
+        :return:        Dict mapping variable ids to scalars or arrays shaped like the variables.
+        """
+
+        return {vid: self._entry(vector, i) for i, vid in enumerate(self.variable_ids)}
+
+    def _entry(self, vector, i):
+        entry = vector[self.offsets[i]:self.offsets[i + 1]]
+        if self.shapes[i] == ():
+            return float(entry[0])
+        return entry.reshape(self.shapes[i]).copy()
+
+    def flatten(self, vid_value_map):
+        """
+        Lays out per-variable quantities (e.g. the gradients returned by a backend) as a vector matching the parameters.
+        Variables missing from the map are set to 0.
+
+        :param vid_value_map:   Dict mapping variable ids to scalars or arrays shaped like the variables.
+        :return:                A vector of the parameter vector's length.
+        """
+
+        vector = np.zeros(len(self.values))
+        for vid, value in vid_value_map.items():
+            i = self.index[vid]
+            vector[self.offsets[i]:self.offsets[i + 1]] = np.ravel(value)
+
+        return vector
+
+    def moment(self, name):
+        """
+        :param name:    Name of an optimizer statistic.
+        :return:        The vector of the statistic, initialized to zeros on first access.
+        """
+
+        if name not in self.moments:
+            self.moments[name] = np.zeros(len(self.values))
+        return self.moments[name]
+
+    def restart(self, variable_feed_dict):
+        """
+        Builds a fresh state from new variable values (i.e. iterations and convergence are reset), carrying over the
+        moments if the variables are laid out the same.
+
+        :param variable_feed_dict:  Dict mapping variable ids to their new values.
+        :return:                    The new state.
+        """
+
+        state = ParameterState(variable_feed_dict)
+        if (state.variable_ids == self.variable_ids) and (state.shapes == self.shapes):
+            state.moments = self.moments
+        return state
+
+    def all_converged(self):
+        return bool(self.converged.all())